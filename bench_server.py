@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Compare the gevent and asyncio server modes of pimp-my-gimp.py.
+
+Each mode is started with simulated lights and simulated odometer pulses, then loaded with
+concurrent HTTP requests. Reports request latency percentiles and the delay from odometer
+pulses to their handling, as measured by the server at /odometer.
+
+Usage: python bench_server.py [--requests N] [--concurrency N] [--pulse-hz HZ]
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# routes exercised under load: the app shell, a static asset and a JSON report
+ROUTES = ["/", "/manifest.json", "/pixels"]
+
+
+def app_dir(root: str) -> str:
+    """
+    Lay out the app as in the container: the modules alongside the contents of site/.
+
+    :param root: An empty directory.
+    :return: The directory to run the app from.
+    """
+    for name in os.listdir(REPO_DIR):
+        if name.endswith(".py"):
+            os.symlink(os.path.join(REPO_DIR, name), os.path.join(root, name))
+    for name in ("static", "templates", "effects"):
+        os.symlink(os.path.join(REPO_DIR, "site", name), os.path.join(root, name))
+    os.mkdir(os.path.join(root, "cache"))
+    return root
+
+
+def get(url: str) -> float:
+    """
+    Request a URL and read the response.
+
+    :return: The request latency, in seconds.
+    """
+    start = time.perf_counter()
+    with urllib.request.urlopen(url, timeout = 10) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def wait_ready(url: str, server: subprocess.Popen, timeout_s: float = 30.0):
+    """
+    Wait until the server answers, or raise if it exits or does not answer in time.
+    """
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited with code {server.returncode}")
+        try:
+            get(url)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"server did not answer at {url}")
+
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def bench(mode: str, port: int, args) -> dict:
+    """
+    Start the app in one mode, load it and collect the results.
+
+    :param mode: 'gevent' or 'asyncio'.
+    :param port: The port to serve on.
+    :return: Request latency percentiles and the server's pulse handling statistics.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        command = [sys.executable, "-u", "pimp-my-gimp.py",
+                   "--no-audio", "--simulate-light",
+                   "--simulate-odometer", str(args.pulse_hz),
+                   "--port", str(port)]
+        if mode == "asyncio":
+            command.append("--asyncio")
+        server = subprocess.Popen(command, cwd = app_dir(root),
+                                  stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+        base = f"http://127.0.0.1:{port}"
+        try:
+            wait_ready(base + "/", server)
+            urls = [base + ROUTES[index % len(ROUTES)] for index in range(args.requests)]
+            start = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(args.concurrency) as executor:
+                latencies = list(executor.map(get, urls))
+            elapsed = time.perf_counter() - start
+            with urllib.request.urlopen(base + "/odometer", timeout = 10) as response:
+                odometer = json.load(response)
+        finally:
+            server.terminate()
+            server.wait()
+    return {
+        'requests_s': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round(max(latencies) * 1000, 2),
+        'pulses': odometer,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Compare request latency and pulse handling of the server modes.")
+    parser.add_argument("--requests", type = int, default = 2000, help = "requests per mode")
+    parser.add_argument("--concurrency", type = int, default = 16, help = "concurrent clients")
+    parser.add_argument("--pulse-hz", type = float, default = 200.0, help = "simulated odometer pulse rate")
+    parser.add_argument("--port", type = int, default = 8080, help = "port to serve on")
+    args = parser.parse_args()
+
+    for mode in ("gevent", "asyncio"):
+        result = bench(mode, args.port, args)
+        print(f"{mode:8} {result['requests_s']:8} req/s  "
+              f"latency p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms, max {result['max_ms']} ms")
+        print(f"{'':8} pulse handling {json.dumps(result['pulses'])}")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Fetch the client libraries vendored into the static directory, for offline use of the web app.
+
+Each library is downloaded from its pinned URL in scootassets.VENDOR_LIBRARIES and verified
+against its SHA-256 checksum in the checksum file. A library without a recorded checksum is not
+fetched. When pinning a new library, run once with --record from a trusted network to record its
+checksum, check it against the published release, and commit the checksum file.
+
+Usage: python fetch_vendor.py [--static-dir DIR] [--checksums FILE] [--record]
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import urllib.request
+
+from scootassets import VENDOR_LIBRARIES
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_checksums(filename: str) -> dict:
+    """
+    Read a checksum file in the format written by sha256sum.
+
+    :param filename: Path of the checksum file.
+    :return: SHA-256 hex digests by library name, empty if there is no such file.
+    """
+    checksums = {}
+    if not os.path.exists(filename):
+        return checksums
+    with open(filename) as checksum_file:
+        for line in checksum_file:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                digest, name = line.split(None, 1)
+                checksums[name] = digest
+    return checksums
+
+
+def write_checksums(filename: str, checksums: dict):
+    """
+    Write a checksum file in the format read by sha256sum -c, replacing it atomically.
+    """
+    with open(filename + ".tmp", 'w') as checksum_file:
+        checksum_file.write("# SHA-256 checksums of the vendored client libraries, verified by fetch_vendor.py\n")
+        for name in sorted(checksums):
+            checksum_file.write(f"{checksums[name]}  {name}\n")
+    os.replace(filename + ".tmp", filename)
+
+
+def fetch(static_dir: str, checksums: dict, record: bool = False) -> bool:
+    """
+    Fetch every vendored library which is missing or does not match its checksum.
+
+    :param static_dir: The static directory to fetch into.
+    :param checksums: Recorded checksums by library name.
+    :param record: Record the checksums of libraries without one, rather than failing.
+    :return: True if every library was fetched or already present and verified.
+    """
+    ok = True
+    for name, url in VENDOR_LIBRARIES.items():
+        if name not in checksums and not record:
+            print(f"No checksum recorded for {name}; run with --record to record it", file = sys.stderr)
+            ok = False
+            continue
+        path = os.path.join(static_dir, name)
+        if os.path.exists(path) and name in checksums:
+            with open(path, 'rb') as library_file:
+                if hashlib.sha256(library_file.read()).hexdigest() == checksums[name]:
+                    continue
+        try:
+            with urllib.request.urlopen(url, timeout = 30) as response:
+                body = response.read()
+        except OSError as e:
+            print(f"Error fetching {name} from {url}: {e}", file = sys.stderr)
+            ok = False
+            continue
+        digest = hashlib.sha256(body).hexdigest()
+        if name not in checksums:
+            print(f"Recorded checksum of {name}: {digest}")
+            checksums[name] = digest
+        elif digest != checksums[name]:
+            print(f"Checksum mismatch for {name} from {url}: expected {checksums[name]}, got {digest}",
+                  file = sys.stderr)
+            ok = False
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path + ".tmp", 'wb') as library_file:
+            library_file.write(body)
+        os.replace(path + ".tmp", path)
+        print(f"Fetched {name}")
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Fetch and verify the vendored client libraries.")
+    parser.add_argument("--static-dir", default = os.path.join(REPO_DIR, "site", "static"),
+                        help = "static directory to fetch into")
+    parser.add_argument("--checksums", default = os.path.join(REPO_DIR, "site", "vendor.sha256"),
+                        help = "checksum file to verify against")
+    parser.add_argument("--record", action = "store_true",
+                        help = "record the checksums of libraries without one, rather than failing")
+    args = parser.parse_args()
+
+    checksums = read_checksums(args.checksums)
+    ok = fetch(args.static_dir, checksums, args.record)
+    if args.record:
+        write_checksums(args.checksums, checksums)
+    sys.exit(0 if ok else 1)
@@ -8,14 +8,24 @@
 #########
 
 # threading
-from gevent import monkey
-monkey.patch_all()
+# the asyncio server mode runs on a single event loop and must not be monkey patched, so the mode
+# is parsed ahead of the other arguments; abbreviations are disabled so that both parses agree
+import sys
+import argparse
+_mode_parser = argparse.ArgumentParser(add_help = False, allow_abbrev = False)
+_mode_parser.add_argument('--asyncio', action = 'store_true')
+ASYNCIO_MODE = _mode_parser.parse_known_args()[0].asyncio
+if not ASYNCIO_MODE:
+    from gevent import monkey
+    monkey.patch_all()
 import threading
 
 # system libraries
-import sys
 import os
+import logging
 import math
+import time
+import asyncio
 from typing import Callable
 
 # NeoPixels
@@ -27,6 +37,25 @@ import scootsound
 # Odometer
 import scootodometer
 
+# Static assets
+import scootassets
+
+# Speed-reactive lighting
+import scootspeedlights
+
+# Logging
+import scootlog
+
+# Declarative effects
+import scooteffects
+
+# Runtime state snapshot for warm restarts
+import scootstate
+
+# asyncio server mode
+if ASYNCIO_MODE:
+    import scootasyncserver
+
 # Detect if running on a Raspberry Pi
 import raspi_detect
 
@@ -40,19 +69,41 @@ else:
 
 # webserver libraries
 from flask import Flask, render_template
-from flask import send_from_directory  # send raw file
-from flask import request
+from flask import request, abort, jsonify
 from flask_socketio import SocketIO, emit
 
-# argument parser
-import argparse
-
 # NeoPixel communication pin 
 PIXEL_PIN = board.D18  # GPIO 18 / pin 12
 # NeoPixel total number of NeoPixels in the array
 PIXEL_COUNT = 163
+# NeoPixel output channels, as (data pin, first pixel, one past the last pixel) of the strip.
+# Segments on separate channels are written concurrently, for longer strips at higher frame rates.
+# Usable pins: PWM0 (D12 or D18), PWM1 (D13 or D19), PCM (D21) and SPI (D10), one pin each, i.e.
+# [(board.D18, 0, 82), (board.D21, 82, PIXEL_COUNT)]
+# PWM0 and PWM1 share the PWM peripheral, so are written together as one output.
+PIXEL_CHANNELS = [
+    (PIXEL_PIN, 0, PIXEL_COUNT),
+]
 # NeoPixel idle color
 PIXEL_COLOR_IDLE = (0, 0, 64)
+# NeoPixel named zones as (first pixel, one past the last pixel); 'all' is always defined.
+# Adjust to match where the strip is mounted.
+PIXEL_ZONES = {
+    "front": (0, 24),
+    "under": (24, PIXEL_COUNT),
+}
+# NeoPixel current budget, in mA. Frames are dimmed to stay within it, to avoid
+# brownouts of the shared 5 V supply. Full white draws about 60 mA per pixel.
+PIXEL_CURRENT_BUDGET_MA = 3000
+# NeoPixel maximum frame rate
+PIXEL_FPS = 100
+
+# Speed lights speed at which the speedometer bar is full, in ft/s
+SPEED_LIGHTS_MAX_FT_S = 10.0
+# Speed lights zone
+SPEED_LIGHTS_ZONE = "front"
+# Speed lights pulse-to-photon latency budget
+SPEED_LIGHTS_LATENCY_BUDGET_S = 0.025
 
 # Encoder GPIO pin
 ENCODER_PIN = 12  # GPIO 12 / pin 32
@@ -66,17 +117,38 @@ ENCODER_SPEED_ZERO_THRESHOLD_S = 1
 # Encoder speed smoothing coefficient (for exponential moving average)
 ENCODER_SMOOTHING = 0.75
 
+# Routes served outside of Flask's url_map, which effects may not be named after:
+# the Socket.IO endpoint of the gevent server and the native websocket of the asyncio server
+EXTERNAL_ROUTES = ("socket.io", "trajectory")
+
 # Program cache directory for persistent data
 CACHE_DIR = "cache/"
 
+# Interval at which the runtime state snapshot is written, if changed
+STATE_WRITE_INTERVAL_S = 1.0
+# Maximum age of a snapshot for a warm restart, if the host boot cannot be identified
+STATE_MAX_AGE_S = 600.0
+# Interval at which the odometer is sampled into the snapshot, which changes with every pulse while riding
+STATE_ODOMETER_INTERVAL_S = 30.0
+
+# Log recent events kept for the /debug/log endpoint
+LOG_RING_CAPACITY = 500
+# Log repeats of a message written per interval; further repeats are counted and dropped
+LOG_REPEAT_BURST = 5
+LOG_REPEAT_INTERVAL_S = 10.0
+
+log = logging.getLogger("pimp-my-gimp")
+
 
 # application entrypoint
 if __name__ == '__main__':
+    launch_time = time.monotonic()
     # parse arguments
     parser = argparse.ArgumentParser(
         prog='pimp-my-gimp.py',
         description='Webserver and controller for enhanced mobility devices.',
-        epilog='May your journey be illuminated.')
+        epilog='May your journey be illuminated.',
+        allow_abbrev=False)
     parser.add_argument(
         "--no-audio",
         action="store_true",
@@ -89,59 +161,142 @@ if __name__ == '__main__':
         "--no-light",
         action="store_true",
         help="disable LED output")
+    parser.add_argument(
+        "--simulate-light",
+        action="store_true",
+        help="write LED output to simulated channels rather than hardware")
+    parser.add_argument(
+        "--speed-lights",
+        choices=scootspeedlights.MODES,
+        help="start with speed-reactive lighting in the given mode")
+    parser.add_argument(
+        "--simulate-odometer",
+        type=float,
+        default=0.0,
+        metavar="HZ",
+        help="produce simulated odometer pulses at the given rate")
+    parser.add_argument(
+        "--asyncio",
+        action="store_true",
+        help="serve from a single asyncio event loop rather than gevent")
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=80,
+        help="port to serve on")
+    parser.add_argument(
+        "--log-level",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        default="INFO",
+        help="lowest level of the messages logged")
     args = parser.parse_args()
+    scootlog.setup(args.log_level, LOG_RING_CAPACITY, LOG_REPEAT_BURST, LOG_REPEAT_INTERVAL_S)
     audio_enabled = True
     if args.no_audio:
-        print("Audio output disabled")
+        log.info("Audio output disabled")
         audio_enabled = False
     odometer_enabled = True
     if args.no_odometer:
         odometer_enabled = False
-        print("Odometer disabled")
+        log.info("Odometer disabled")
     pixels_enabled = True
     if args.no_light:
         pixels_enabled = False
-        print("Light disabled")
+        log.info("Light disabled")
+    elif args.simulate_light:
+        log.info("Light simulated")
 
     # Initialize Flask app and SocketIO
-    app = Flask(__name__)
-    app.config['TEMPLATES_AUTO_RELOAD'] = True
+    # static files are served from memory by the asset store rather than by Flask
+    app = Flask(__name__, static_folder = None)
     socketio = SocketIO(app, cors_allowed_origins = "*", async_mode = "gevent")
 
+    def request_zone() -> str:
+        """
+        Read the zone to play an effect in from the 'zone' query argument.
+
+        :return: The name of the zone, 'all' if not specified. Aborts with 400 if the zone is unknown.
+        """
+        zone = request.args.get('zone', default="all", type=str)
+        if zone not in pixels.zones:
+            log.warning("Unknown zone '%s'.", zone)
+            abort(400)
+        return zone
+
+    def effect_route(effect: scooteffects.Effect) -> Callable[[], str]:
+        """
+        Build the route for a declarative effect, playing its compiled frames and its sound.
+
+        :param effect: The effect to play.
+        :return: The view function.
+        """
+        def play_effect():
+            log.info("Endpoint '/%s': Accessed by %s", effect.name, request.remote_addr)
+            zone = request_zone()
+            # compiled at startup, so this is a lookup
+            program = effects.program(effect, len(pixels.zones[zone]))
+            thread = sounds.play(sounds.load(effect.sound)) if effect.sound else None
+            pixels.play(effect.name, iter(program), zone, effect.blend)
+            if thread is not None:
+                thread.join()
+            pixels.solid(PIXEL_COLOR_IDLE)
+            log.info("... Endpoint '/%s' complete", effect.name)
+            return ""
+        return play_effect
+
     @app.route("/")
     def index():
         """
-        Serve the index page.
+        Serve the index page, pre-rendered at startup.
         
-        :return: Rendered index.html template.
+        :return: index.html from the asset store, or 304 if the client copy is current.
         """
-        print(f"Endpoint '/': Accessed by {request.remote_addr}")
-        return render_template('index.html')
+        log.info("Endpoint '/': Accessed by %s", request.remote_addr)
+        return assets.response(assets.get("index.html"))
 
     @app.route("/favicon.ico")
     def favicon():
         """
         Serve the favicon.ico file.
         
-        :return: favicon.ico from the static/images directory.
+        :return: favicon.ico from the asset store, or 304 if the client copy is current.
         """
-        print(f"Endpoint '/favicon.ico': Accessed by {request.remote_addr}")
-        return send_from_directory(
-            os.path.join(app.root_path, 'static/images'),
-            'favicon.ico',
-            mimetype='image/vnd.microsoft.icon')
+        log.info("Endpoint '/favicon.ico': Accessed by %s", request.remote_addr)
+        return assets.response(assets.get("images/favicon.ico"))
 
     @app.route("/manifest.json")
     def manifest():
         """
         Serve the manifest.json file.
         
-        :return: manifest.json from the static directory.
+        :return: manifest.json from the asset store, or 304 if the client copy is current.
+        """
+        log.info("Endpoint '/manifest.json': Accessed by %s", request.remote_addr)
+        return assets.response(assets.get("manifest.json"))
+
+    @app.route("/sw.js")
+    def service_worker():
+        """
+        Serve the service worker, pre-rendered at startup. Served from the root so
+        that its scope covers the index page.
+        
+        :return: sw.js from the asset store, or 304 if the client copy is current.
         """
-        print(f"Endpoint '/manifest.json': Accessed by {request.remote_addr}")
-        return send_from_directory(
-            os.path.join(app.root_path, 'static'),
-            'manifest.json',)
+        log.info("Endpoint '/sw.js': Accessed by %s", request.remote_addr)
+        return assets.response(assets.get("sw.js"))
+
+    @app.route("/static/<path:filename>")
+    def static_file(filename):
+        """
+        Serve a static file. Versioned URLs are cached indefinitely by the client.
+
+        :param filename: Path of the file, relative to the static directory.
+        :return: The file from the asset store, or 304 if the client copy is current.
+        """
+        asset = assets.get(filename)
+        if asset is None:
+            abort(404)
+        return assets.response(asset)
 
     @app.route("/disco")
     def disco():
@@ -150,12 +305,13 @@ if __name__ == '__main__':
         
         :return: An empty string response after the effect.
         """
-        print(f"Endpoint '/disco': Accessed by {request.remote_addr}")
+        log.info("Endpoint '/disco': Accessed by %s", request.remote_addr)
+        zone = request_zone()
         thread = sounds.play(sounds.sound_disco)
-        pixels.disco(2, 0.5)
+        pixels.disco(2, 0.5, zone)
         thread.join()
         pixels.solid(PIXEL_COLOR_IDLE)
-        print("... Endpoint '/disco' complete")
+        log.info("... Endpoint '/disco' complete")
         return ""
 
     @app.route("/fireplace")
@@ -165,12 +321,13 @@ if __name__ == '__main__':
         
         :return: An empty string response after the effect.
         """
-        print(f"Endpoint '/fireplace': Accessed by {request.remote_addr}")
+        log.info("Endpoint '/fireplace': Accessed by %s", request.remote_addr)
+        zone = request_zone()
         thread = sounds.play(sounds.sound_fireplace)
-        pixels.fireplace()
+        pixels.fireplace(zone = zone)
         thread.join()
         pixels.solid(PIXEL_COLOR_IDLE)
-        print("... Endpoint '/fireplace' complete")
+        log.info("... Endpoint '/fireplace' complete")
         return ""
 
     @app.route("/underlight")
@@ -180,12 +337,13 @@ if __name__ == '__main__':
         
         :return: An empty string response after the effect.
         """
-        print(f"Endpoint '/underlight': Accessed by {request.remote_addr}")
+        log.info("Endpoint '/underlight': Accessed by %s", request.remote_addr)
+        zone = request_zone()
         thread = sounds.play(sounds.sound_underlight)
-        pixels.underlight()
+        pixels.underlight(zone = zone)
         thread.join()
         pixels.solid(PIXEL_COLOR_IDLE)
-        print("... Endpoint '/underlight' complete")
+        log.info("... Endpoint '/underlight' complete")
         return ""
 
     @app.route("/energyweapon")
@@ -195,12 +353,13 @@ if __name__ == '__main__':
         
         :return: An empty string response after the effect.
         """
-        print(f"Endpoint '/energyweapon': Accessed by {request.remote_addr}")
+        log.info("Endpoint '/energyweapon': Accessed by %s", request.remote_addr)
+        zone = request_zone()
         thread = sounds.play(sounds.sound_energyweapon)
-        pixels.energyweapon()
+        pixels.energyweapon(zone)
         thread.join()
         pixels.solid(PIXEL_COLOR_IDLE)
-        print("... Endpoint '/energyweapon' complete")
+        log.info("... Endpoint '/energyweapon' complete")
         return ""
 
     @app.route("/meltdown")
@@ -210,14 +369,14 @@ if __name__ == '__main__':
         
         :return: An empty string response after the effect.
         """
-        print(f"Endpoint '/meltdown': Accessed by {request.remote_addr}")
+        log.info("Endpoint '/meltdown': Accessed by %s", request.remote_addr)
         for count in range(3):
             thread = sounds.play(sounds.sound_meltdown)
             pixels.flash((255,255,255), 2)
             pixels.flash((255,0,0), 1)
             thread.join()
         pixels.solid(PIXEL_COLOR_IDLE)
-        print("... Endpoint '/meltdown' complete")
+        log.info("... Endpoint '/meltdown' complete")
         return ""
     
     @app.route("/color")
@@ -227,7 +386,7 @@ if __name__ == '__main__':
         
         :return: An empty string response after the effect.
         """
-        print(f"Endpoint '/color': Accessed by {request.remote_addr}")
+        log.info("Endpoint '/color': Accessed by %s", request.remote_addr)
         idle_color = "#{:02x}{:02x}{:02x}".format(*PIXEL_COLOR_IDLE)
         hex_color = request.args.get('rgb', default=idle_color, type=str)
         # Check if the hex color starts with '#', and remove it
@@ -236,13 +395,13 @@ if __name__ == '__main__':
 
         # Check if the remaining string has a length of 6
         if len(hex_color) != 6:
-            print("Error: Invalid hex color length. Must be 6 characters long.")
+            log.warning("Invalid hex color length. Must be 6 characters long.")
             return
         # Check if all characters are valid hexadecimal digits
         if not all(c in '0123456789abcdefABCDEF' for c in hex_color):
-            print("Error: Invalid hex color. Contains non-hexadecimal characters.")
+            log.warning("Invalid hex color. Contains non-hexadecimal characters.")
 
-        print("Color selected: " + hex_color)
+        log.info("Color selected: %s", hex_color)
 
         # Convert the characters from hex to integers
         r = int(hex_color[0:2], 16)
@@ -250,7 +409,7 @@ if __name__ == '__main__':
         b = int(hex_color[4:6], 16)
         pixels.solid((r,g,b))
 
-        print("... Endpoint '/color' complete")
+        log.info("... Endpoint '/color' complete")
         return ""
 
     @app.route("/lights-out")
@@ -260,12 +419,76 @@ if __name__ == '__main__':
         
         :return: An empty string response after turning off the lights.
         """
-        print(f"Endpoint '/lights-out': Accessed by {request.remote_addr}")
+        log.info("Endpoint '/lights-out': Accessed by %s", request.remote_addr)
         sounds.play(sounds.sound_lights_out).join()
         pixels.off()
-        print("... Endpoint '/lights-out' complete")
+        log.info("... Endpoint '/lights-out' complete")
         return ""
         
+    @app.route("/speedlights")
+    def speedlights_mode():
+        """
+        Handle the speedlights route to start or stop speed-reactive lighting.
+        
+        :return: An empty string response.
+        """
+        log.info("Endpoint '/speedlights': Accessed by %s", request.remote_addr)
+        zone = request_zone() if 'zone' in request.args else SPEED_LIGHTS_ZONE
+        mode = request.args.get('mode', default=scootspeedlights.MODE_BAR, type=str)
+        if mode == "off":
+            speedlights.stop()
+        elif mode in scootspeedlights.MODES:
+            speedlights.start(mode, zone)
+        else:
+            log.warning("Unknown speed lights mode '%s'.", mode)
+            abort(400)
+        log.info("... Endpoint '/speedlights' complete")
+        return ""
+
+    @app.route("/pixels")
+    def pixels_stats():
+        """
+        Report LED output statistics, such as the frame rate achieved by each channel.
+        
+        :return: JSON output statistics.
+        """
+        log.info("Endpoint '/pixels': Accessed by %s", request.remote_addr)
+        return jsonify(pixels.stats())
+
+    @app.route("/odometer")
+    def odometer_stats():
+        """
+        Report the delay from odometer pulses to their handling.
+        
+        :return: JSON pulse handling statistics.
+        """
+        log.info("Endpoint '/odometer': Accessed by %s", request.remote_addr)
+        return jsonify(odometer.stats())
+
+    @app.route("/latency")
+    def latency():
+        """
+        Report the pulse-to-photon latency of speed-reactive lighting.
+        
+        :return: JSON latency statistics.
+        """
+        log.info("Endpoint '/latency': Accessed by %s", request.remote_addr)
+        return jsonify(speedlights.latency())
+
+    @app.route("/debug/log")
+    def debug_log():
+        """
+        Report the most recent log events. The number of events and the lowest level may be given
+        with the 'count' and 'level' query arguments.
+        
+        :return: JSON list of events, oldest first.
+        """
+        try:
+            return jsonify(scootlog.recent(request.args.get('count', type = int), request.args.get('level', "NOTSET")))
+        except ValueError as e:
+            log.warning("%s", e)
+            abort(400)
+        
     @socketio.on('connect', namespace='/trajectory')
     def trajectory_connect():
         """
@@ -276,56 +499,166 @@ if __name__ == '__main__':
         :return: None.
         """
         client_ip = request.remote_addr  # Gets the client's IP address
-        print(f"WebSocket client connected from {client_ip}: /trajectory")
-
-    print("Reading odometer cache.")
-    odometer_cache = scootodometer.ScootOdometerCache(CACHE_DIR + "odometer.ini")
-    print("... read last known position " + str(odometer_cache.get_distance()))
+        log.info("WebSocket client connected from %s: /trajectory", client_ip)
+
+    log.info("Loading effects")
+    effects = scooteffects.EffectLibrary(os.path.join(app.root_path, "effects"), CACHE_DIR + "effects/")
+    # effects are routed by name, so may not take the name of a route of either server
+    effects.load(reserved = tuple(rule.rule.strip("/").split("/")[0] for rule in app.url_map.iter_rules())
+                            + EXTERNAL_ROUTES)
+    for effect in effects:
+        app.add_url_rule("/" + effect.name, "effect_" + effect.name, effect_route(effect))
+    log.info("... effects loaded: %s", ", ".join(effect.name for effect in effects))
+
+    # in asyncio mode, periodic work runs as tasks on this loop rather than in threads
+    loop = asyncio.new_event_loop() if args.asyncio else None
+
+    log.info("Reading runtime state")
+    state = scootstate.ScootState(CACHE_DIR + "state.json",
+                                  STATE_WRITE_INTERVAL_S,
+                                  STATE_MAX_AGE_S,
+                                  timer = loop is None)
+    if state.warm:
+        log.info("... warm restart, from state saved %.1f s ago", state.age_s())
+    else:
+        log.info("... cold start")
+
+    log.info("Loading static assets")
+    assets = scootassets.ScootAssets(os.path.join(app.root_path, "static"), cache_dir = CACHE_DIR + "assets/")
+    assets.load()
+    app.jinja_env.globals['asset_url'] = assets.url
+    with app.app_context():
+        # the asyncio server streams trajectory data over a native websocket rather than socket.io
+        assets.render_shell(render_template, native_websocket = args.asyncio, effects = list(effects))
+    identity_size, compressed_size = assets.size()
+    log.info("... static assets loaded (%d bytes, %d bytes compressed)", identity_size, compressed_size)
+
+    log.info("Reading odometer cache.")
+    odometer_cache = scootodometer.ScootOdometerCache(CACHE_DIR + "odometer.ini", timer = loop is None)
+    log.info("... read last known position %s", odometer_cache.get_distance())
+
+    log.info("Initializing pixels")
+    pixels = scootpixels.ScootPixels(PIXEL_PIN,
+                                     PIXEL_COUNT,
+                                     pixels_enabled,
+                                     PIXEL_ZONES,
+                                     PIXEL_FPS,
+                                     PIXEL_CHANNELS,
+                                     args.simulate_light,
+                                     PIXEL_CURRENT_BUDGET_MA)
+    # on a warm restart, skip the boot sequence and show the color from before the restart
+    pixels_restored = state.restore("pixels", lambda saved: pixels.solid(tuple(saved['color'])))
+    if not pixels_restored:
+        pixels.tricolor()
+        pixels.solid(PIXEL_COLOR_IDLE)
+    state.register("pixels", pixels.state)
+    log.info("... pixels initialized")
 
-    print("Initializing pixels")
-    pixels = scootpixels.ScootPixels(PIXEL_PIN, PIXEL_COUNT, pixels_enabled)
-    pixels.tricolor()
-    pixels.solid(PIXEL_COLOR_IDLE)
-    print("... pixels initialized")
+    log.info("Compiling effects")
+    effects.prepare(len(zone) for zone in pixels.zones.values())
+    log.info("... effects compiled")
 
-    print("Initializing odometer")
+    def resume_effects(pixels_state: dict):
+        """
+        Resume the effects playing before the restart, as if it had not happened.
+        """
+        # read every effect before playing any, so that a malformed section resumes none
+        resumed = [(effects.get(saved['name']), saved['zone'], float(saved['elapsed_s']))
+                   for saved in pixels_state['effects'] if saved['zone'] in pixels.zones]
+        for effect, zone, elapsed_s in resumed:
+            if effect is None:
+                continue
+            program = effects.program(effect, len(pixels.zones[zone]))
+            layer = pixels.play(effect.name,
+                                program.resume(elapsed_s + state.age_s()),
+                                zone,
+                                effect.blend,
+                                wait = False)
+            if layer is not None:
+                layer.add_done_callback(lambda: pixels.solid(PIXEL_COLOR_IDLE))
+            log.info("... resumed effect '%s'", effect.name)
+
+    if pixels_restored:
+        state.restore("pixels", resume_effects)
+
+    log.info("Initializing odometer")
     odometer = scootodometer.ScootOdometer(ENCODER_PIN,
                                            ENCODER_SMOOTHING,
                                            ENCODER_SPEED_ZERO_THRESHOLD_S,
                                            odometer_cache.get_distance(),
-                                           odometer_enabled)
-    # WebSocket emit on encoder pulses
-    odometer.register_callback(lambda timestamp, position, speed, socketio = socketio : 
-        socketio.emit('newdata', {
-            'timestamp': math.ceil(timestamp * 1000),
-            'position': position / ENCODER_PULSES_PER_FOOT,
-            'speed': speed / ENCODER_PULSES_PER_FOOT},
-        namespace='/trajectory')
-    )
+                                           odometer_enabled,
+                                           loop,
+                                           args.simulate_odometer)
+    state.restore("odometer", odometer.restore)
+    state.register("odometer", odometer.state, STATE_ODOMETER_INTERVAL_S)
+    # Speed-reactive lighting on encoder pulses
+    # registered first, so the pixels are updated ahead of the other callbacks
+    speedlights = scootspeedlights.ScootSpeedLights(pixels,
+                                                    ENCODER_PULSES_PER_FOOT,
+                                                    SPEED_LIGHTS_MAX_FT_S,
+                                                    SPEED_LIGHTS_LATENCY_BUDGET_S)
+    odometer.register_callback(speedlights.update)
+    if args.speed_lights:
+        speedlights.start(args.speed_lights, SPEED_LIGHTS_ZONE)
+    else:
+        state.restore("speedlights", speedlights.restore)
+    state.register("speedlights", speedlights.state)
+    # WebSocket emit on encoder pulses; the asyncio server registers its own
+    if not args.asyncio:
+        odometer.register_callback(lambda timestamp, position, speed, socketio = socketio : 
+            socketio.emit('newdata', {
+                'timestamp': math.ceil(timestamp * 1000),
+                'position': position / ENCODER_PULSES_PER_FOOT,
+                'speed': speed / ENCODER_PULSES_PER_FOOT},
+            namespace='/trajectory')
+        )
     # Update persistent data on encoder pulses
     odometer.register_callback(lambda timestamp, position, speed, odometer_cache = odometer_cache:
         # Write cache every 100 pulses
         (position - odometer_cache.get_distance() > 100) and odometer_cache.set_distance(timestamp, position, speed) 
     )
-    print("... odometer initialized")
+    log.info("... odometer initialized")
 
-    print("Initializing sounds")
-    sounds = scootsound.ScootSound(audio_enabled)
+    log.info("Initializing sounds")
+    # decoded sounds are kept in the cache across restarts, whether warm or cold
+    sounds = scootsound.ScootSound(audio_enabled, CACHE_DIR + "sounds/")
     sounds.import_from_disk()
-    print("... sounds initialized")
+    for effect in effects:
+        if effect.sound:
+            sounds.load(effect.sound)
+    log.info("... sounds initialized")
+
+    log.info("Ready in %.2f s (%s start)", time.monotonic() - launch_time, "warm" if state.warm else "cold")
     
     try:
-        print("Starting Flask server")
-        socketio.run(app,
-                    host = "0.0.0.0",
-                    port = 80)
+        if args.asyncio:
+            log.info("Starting asyncio server")
+            server = scootasyncserver.ScootAsyncServer(assets,
+                                                       pixels,
+                                                       sounds,
+                                                       effects,
+                                                       odometer,
+                                                       odometer_cache,
+                                                       speedlights,
+                                                       state,
+                                                       PIXEL_COLOR_IDLE,
+                                                       ENCODER_PULSES_PER_FOOT,
+                                                       SPEED_LIGHTS_ZONE)
+            loop.run_until_complete(server.run(host = "0.0.0.0", port = args.port))
+        else:
+            log.info("Starting Flask server")
+            socketio.run(app,
+                        host = "0.0.0.0",
+                        port = args.port)
     except KeyboardInterrupt:
-        print("Flask server terminated.")
+        log.info("Server terminated.")
     finally:
+        # the final snapshot is written before the pixels are turned off
+        state.deinit()
         odometer.deinit()
         odometer_cache.deinit()
         pixels.solid()
         pixels.deinit()
 
-    print("Application terminated")
+    log.info("Application terminated")
     sys.exit(0)
\ No newline at end of file
@@ -0,0 +1,311 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+from typing import Callable
+
+# webserver libraries
+from flask import Response, request
+from werkzeug.http import parse_accept_header, parse_etags
+
+# brotli is optional; gzip is always available
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Mimetypes worth compressing. Images and audio are already compressed.
+COMPRESSIBLE_MIMETYPES = (
+    'text/',
+    'application/javascript',
+    'application/json',
+    'application/manifest+json',
+    'image/svg+xml',
+    'image/vnd.microsoft.icon',
+)
+
+# Cache-Control for versioned URLs, which change whenever the content changes
+CACHE_CONTROL_IMMUTABLE = "public, max-age=31536000, immutable"
+# Cache-Control for unversioned URLs, which must be revalidated with the ETag
+CACHE_CONTROL_REVALIDATE = "no-cache"
+
+# Client libraries vendored into the static directory by fetch_vendor.py, by name with their pinned URLs.
+# Until vendored, such as when running outside of Docker, they are referenced at their pinned URLs instead.
+VENDOR_LIBRARIES = {
+    'vendor/socket.io.min.js': "https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.7.2/socket.io.min.js",
+    'vendor/chart.umd.js': "https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.js",
+    'vendor/moment.min.js': "https://cdnjs.cloudflare.com/ajax/libs/moment.js/2.29.4/moment.min.js",
+    'vendor/chartjs-adapter-moment.min.js': "https://cdn.jsdelivr.net/npm/chartjs-adapter-moment@1.0.1/dist/chartjs-adapter-moment.min.js",
+    'vendor/iro.min.js': "https://cdn.jsdelivr.net/npm/@jaames/iro@5.5.1/dist/iro.min.js",
+}
+
+log = logging.getLogger(__name__)
+
+mimetypes.add_type('application/manifest+json', '.webmanifest')
+mimetypes.add_type('image/webp', '.webp')
+
+
+class Asset:
+    """
+    A static asset held in memory with precompressed encodings and a strong ETag.
+
+    Attributes:
+        mimetype (str): The mimetype of the asset.
+        version (str): Short content hash, used to build versioned URLs.
+        encodings (dict): Body of the asset for each content-coding, i.e. 'identity', 'gzip', 'br'.
+    """
+
+    def __init__(self, body: bytes, mimetype: str, cache_dir: str = None):
+        """
+        Initialize the asset and precompress it if the mimetype is compressible.
+
+        :param body: The uncompressed content of the asset.
+        :param mimetype: The mimetype of the asset.
+        :param cache_dir: Directory in which compressed encodings are kept by content hash,
+                          so that unchanged assets are compressed only once. Defaults to none.
+        """
+        self.mimetype = mimetype
+        self._digest = hashlib.sha256(body).hexdigest()
+        self.version = self._digest[:12]
+        self.encodings = {'identity': body}
+
+        if mimetype.startswith(COMPRESSIBLE_MIMETYPES):
+            compressors = {'gzip': lambda: gzip.compress(body, compresslevel = 9, mtime = 0)}
+            if brotli is not None:
+                compressors['br'] = lambda: brotli.compress(body, quality = 11)
+            for encoding, compress in compressors.items():
+                compressed = self._compressed(encoding, compress, cache_dir)
+                # only keep encodings which are actually smaller
+                if len(compressed) < len(body):
+                    self.encodings[encoding] = compressed
+
+    def _compressed(self, encoding: str, compress, cache_dir: str) -> bytes:
+        """
+        Compress the asset, or read it from the cache directory if compressed before.
+        """
+        if cache_dir is None:
+            return compress()
+        path = os.path.join(cache_dir, self.etag(encoding))
+        try:
+            with open(path, 'rb') as cache_file:
+                return cache_file.read()
+        except OSError:
+            pass
+        compressed = compress()
+        try:
+            os.makedirs(cache_dir, exist_ok = True)
+            with open(path + ".tmp", 'wb') as cache_file:
+                cache_file.write(compressed)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            log.warning("Could not cache compressed asset %s: %s", path, e)
+        return compressed
+
+    def etag(self, encoding: str = 'identity') -> str:
+        """
+        Strong ETag of one encoding of the asset. Each encoding is a distinct representation.
+
+        :param encoding: The content-coding.
+        :return: The unquoted ETag.
+        """
+        if encoding == 'identity':
+            return self._digest[:32]
+        return self._digest[:32] + "-" + encoding
+
+    def negotiate(self, accept_encoding: str) -> str:
+        """
+        Select the smallest encoding accepted by a request.
+
+        :param accept_encoding: The Accept-Encoding header of the request.
+        :return: The content-coding to send.
+        """
+        accept_encodings = parse_accept_header(accept_encoding)
+        for encoding in ('br', 'gzip'):
+            if encoding in self.encodings and accept_encodings[encoding]:
+                return encoding
+        return 'identity'
+
+    def not_modified(self, if_none_match: str) -> bool:
+        """
+        Check if a request already holds any representation of this asset.
+
+        :param if_none_match: The If-None-Match header of the request.
+        :return: True if a 304 response may be sent.
+        """
+        if_none_match = parse_etags(if_none_match)
+        if not if_none_match:
+            return False
+        if if_none_match.star_tag:
+            return True
+        return any(if_none_match.contains_weak(self.etag(encoding)) for encoding in self.encodings)
+
+
+class ScootAssets:
+    """
+    In-memory static asset store. All assets are read, hashed and precompressed once at startup,
+    so requests are answered without touching the disk, and repeat visits are answered with 304.
+
+    Attributes:
+        static_dir (str): Directory from which the static assets are loaded.
+        url_prefix (str): URL prefix under which static assets are served.
+        cache_dir (str): Directory in which compressed encodings are kept across restarts, or None.
+    """
+
+    def __init__(self, static_dir: str, url_prefix: str = "static/", cache_dir: str = None):
+        """
+        Initialize an empty asset store.
+
+        :param static_dir: Directory from which the static assets are loaded.
+        :param url_prefix: URL prefix under which static assets are served.
+        :param cache_dir: Directory in which compressed encodings are kept across restarts. Defaults to none.
+        """
+        self.static_dir = static_dir
+        self.url_prefix = url_prefix
+        self.cache_dir = cache_dir
+        self._assets = {}
+
+    def load(self):
+        """
+        Read, hash and precompress every file in the static directory.
+        This method blocks while reading and compressing, which may be lengthy.
+        """
+        for root, _, files in os.walk(self.static_dir):
+            for file in files:
+                path = os.path.join(root, file)
+                name = os.path.relpath(path, self.static_dir).replace(os.sep, "/")
+                with open(path, 'rb') as asset_file:
+                    self.add(name, asset_file.read())
+
+    def add(self, name: str, body: bytes, mimetype: str = None) -> Asset:
+        """
+        Add an asset to the store, replacing any asset with the same name.
+
+        :param name: Name of the asset, relative to the static directory.
+        :param body: The uncompressed content of the asset.
+        :param mimetype: The mimetype of the asset. Guessed from the name if not given.
+        :return: The added asset.
+        """
+        if mimetype is None:
+            mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        asset = Asset(body, mimetype, self.cache_dir)
+        self._assets[name] = asset
+        return asset
+
+    def get(self, name: str) -> Asset:
+        """
+        Retrieve an asset by name.
+
+        :param name: Name of the asset, relative to the static directory.
+        :return: The asset, or None if there is no such asset.
+        """
+        return self._assets.get(name)
+
+    def url(self, name: str) -> str:
+        """
+        Build a versioned URL for an asset. Versioned URLs may be cached indefinitely.
+        Intended for use as a template global.
+
+        :param name: Name of the asset, relative to the static directory.
+        :return: The URL of the asset, relative to the index page, or the pinned URL of a
+                 vendored library which has not been fetched.
+        """
+        asset = self.get(name)
+        if asset is None:
+            return VENDOR_LIBRARIES.get(name, self.url_prefix + name)
+        return self.url_prefix + name + "?v=" + asset.version
+
+    def version(self, *names: str) -> str:
+        """
+        Combined content hash of several assets, which changes whenever any of them changes.
+
+        :param names: Names of the assets.
+        :return: Short combined content hash.
+        """
+        combined = "".join(self.get(name).version for name in names)
+        return hashlib.sha256(combined.encode()).hexdigest()[:12]
+
+    def referenced(self, text: str) -> list:
+        """
+        Find the versioned URLs of all assets referenced by a document, such as the rendered index.
+
+        :param text: The document to search.
+        :return: A sorted list of versioned asset URLs appearing in the document.
+        """
+        return sorted(url for url in map(self.url, self._assets) if url in text)
+
+    def size(self) -> (int, int):
+        """
+        Total size of the assets as stored on disk and as sent to a client accepting compression.
+
+        :return: A tuple containing the identity size and the smallest encoded size, in bytes.
+        """
+        identity = sum(len(asset.encodings['identity']) for asset in self._assets.values())
+        smallest = sum(min(len(body) for body in asset.encodings.values()) for asset in self._assets.values())
+        return identity, smallest
+
+    def render_shell(self, render: Callable[..., str], **context):
+        """
+        Pre-render the index page and the service worker precaching it into the store.
+        Call after load(), with asset_url() available to the templates.
+
+        :param render: Renders a template, with signature (template_name: str, **context) -> str.
+        :param context: Variables passed to the index template.
+        """
+        index_html = render('index.html', **context)
+        self.add("index.html", index_html.encode(), "text/html; charset=utf-8")
+        # the index embeds versioned asset URLs, so its version changes with any of them
+        precache_urls = ["./", "manifest.json"] + self.referenced(index_html)
+        self.add("sw.js",
+                 render('sw.js',
+                        version = self.version("index.html", "manifest.json"),
+                        precache_urls = precache_urls).encode(),
+                 "application/javascript")
+
+    def respond(self,
+                asset: Asset,
+                headers,
+                version: str = None,
+                cache_control: str = None) -> (int, dict, bytes):
+        """
+        Build the response to a request for an asset, honoring conditional requests and Accept-Encoding.
+        Independent of the web framework.
+
+        :param asset: The asset to send.
+        :param headers: The request headers, as a mapping.
+        :param version: The 'v' query argument of the request, if any.
+        :param cache_control: The Cache-Control header. Defaults to immutable for versioned URLs
+                              matching the asset, and revalidation otherwise.
+        :return: A tuple containing the status, the response headers and the body,
+                 either the asset or 304 Not Modified.
+        """
+        if cache_control is None:
+            if version == asset.version:
+                cache_control = CACHE_CONTROL_IMMUTABLE
+            else:
+                cache_control = CACHE_CONTROL_REVALIDATE
+
+        encoding = asset.negotiate(headers.get('Accept-Encoding'))
+        response_headers = {
+            'ETag': '"' + asset.etag(encoding) + '"',
+            'Cache-Control': cache_control,
+            'Vary': 'Accept-Encoding',
+        }
+        if asset.not_modified(headers.get('If-None-Match')):
+            return 304, response_headers, b""
+        response_headers['Content-Type'] = asset.mimetype
+        if encoding != 'identity':
+            response_headers['Content-Encoding'] = encoding
+        return 200, response_headers, asset.encodings[encoding]
+
+    def response(self, asset: Asset, cache_control: str = None) -> Response:
+        """
+        Build a Flask response for the current request.
+
+        :param asset: The asset to send.
+        :param cache_control: The Cache-Control header. Defaults to immutable for versioned URLs
+                              matching the asset, and revalidation otherwise.
+        :return: The response, either the asset or 304 Not Modified.
+        """
+        status, headers, body = self.respond(asset, request.headers, request.args.get('v'), cache_control)
+        return Response(body, status = status, headers = headers)
@@ -0,0 +1,384 @@
+import asyncio
+import json
+import logging
+import math
+
+# webserver libraries
+from aiohttp import web
+
+import scootassets
+import scooteffects
+import scootlog
+import scootodometer
+import scootpixels
+import scootsound
+import scootspeedlights
+import scootstate
+
+log = logging.getLogger(__name__)
+
+# Trajectory messages queued per websocket client; the oldest are dropped for slow clients
+TRAJECTORY_QUEUE_SIZE = 64
+
+
+class ScootAsyncServer:
+    """
+    Serves the web app, effect routes and trajectory data from a single asyncio event loop,
+    as an alternative to the gevent server. Effects run as tasks awaiting their sounds and
+    light layers, and trajectory data is streamed over a native websocket at /trajectory.
+    """
+
+    def __init__(self,
+                 assets: scootassets.ScootAssets,
+                 pixels: scootpixels.ScootPixels,
+                 sounds: scootsound.ScootSound,
+                 effects: scooteffects.EffectLibrary,
+                 odometer: scootodometer.ScootOdometer,
+                 odometer_cache: scootodometer.ScootOdometerCache,
+                 speedlights: scootspeedlights.ScootSpeedLights,
+                 state: scootstate.ScootState,
+                 idle_color: tuple,
+                 pulses_per_foot: float,
+                 speedlights_zone: str = "all"):
+        """
+        Initialize the server and its routes.
+
+        :param assets: Asset store with the pre-rendered index.
+        :param pixels: The pixels to play effects on.
+        :param sounds: The sounds to play with effects.
+        :param effects: Declarative effects, each routed by name.
+        :param odometer: The odometer, created with this event loop.
+        :param odometer_cache: The odometer cache, created without a timer.
+        :param speedlights: The speed-reactive lighting.
+        :param state: The runtime state snapshot, created without a timer.
+        :param idle_color: Color shown after each effect.
+        :param pulses_per_foot: Encoder pulses per linear foot.
+        :param speedlights_zone: Default zone for speed-reactive lighting.
+        """
+        self._assets = assets
+        self._pixels = pixels
+        self._sounds = sounds
+        self._effects = effects
+        self._odometer = odometer
+        self._odometer_cache = odometer_cache
+        self._speedlights = speedlights
+        self._state = state
+        self._idle_color = idle_color
+        self._pulses_per_foot = pulses_per_foot
+        self._speedlights_zone = speedlights_zone
+        self._trajectory_clients = set()
+        odometer.register_callback(self._trajectory_update)
+
+        self._app = web.Application()
+        self._app.add_routes([
+            web.get("/", self.index),
+            web.get("/favicon.ico", self.favicon),
+            web.get("/manifest.json", self.manifest),
+            web.get("/sw.js", self.service_worker),
+            web.get("/static/{filename:.+}", self.static_file),
+            web.get("/disco", self.disco),
+            web.get("/fireplace", self.fireplace),
+            web.get("/underlight", self.underlight),
+            web.get("/energyweapon", self.energyweapon),
+            web.get("/meltdown", self.meltdown),
+            web.get("/color", self.color),
+            web.get("/lights-out", self.lights_out),
+            web.get("/speedlights", self.speedlights_mode),
+            web.get("/pixels", self.pixels_stats),
+            web.get("/odometer", self.odometer_stats),
+            web.get("/latency", self.latency),
+            web.get("/debug/log", self.debug_log),
+            web.get("/trajectory", self.trajectory),
+        ])
+        # effects are routed by name, so may not take the name of a route registered above
+        routes = {resource.canonical.strip("/").split("/")[0] for resource in self._app.router.resources()}
+        for effect in effects:
+            if effect.name in routes:
+                log.error("Skipping effect '%s': name is reserved", effect.name)
+                continue
+            self._app.router.add_get("/" + effect.name, self._effect_route(effect))
+
+    async def run(self, host: str = "0.0.0.0", port: int = 80):
+        """
+        Serve, and run the odometer, odometer cache and runtime state tasks, until cancelled.
+
+        :param host: The address to listen on.
+        :param port: The port to listen on.
+        """
+        runner = web.AppRunner(self._app)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, host, port).start()
+            await asyncio.gather(self._odometer.run_async(),
+                                 self._odometer_cache.run_async(),
+                                 self._state.run_async())
+        finally:
+            await runner.cleanup()
+
+    def _asset(self, request: web.Request, name: str) -> web.Response:
+        """
+        Respond with an asset from the store, or 304 if the client copy is current.
+        """
+        asset = self._assets.get(name)
+        if asset is None:
+            raise web.HTTPNotFound()
+        status, headers, body = self._assets.respond(asset, request.headers, request.query.get('v'))
+        return web.Response(status = status, headers = headers, body = body)
+
+    def _zone(self, request: web.Request) -> str:
+        """
+        Read the zone to play an effect in from the 'zone' query argument.
+
+        :return: The name of the zone, 'all' if not specified. Raises 400 if the zone is unknown.
+        """
+        zone = request.query.get('zone', "all")
+        if zone not in self._pixels.zones:
+            log.warning("Unknown zone '%s'.", zone)
+            raise web.HTTPBadRequest()
+        return zone
+
+    @staticmethod
+    async def _effect(layer, sound):
+        """
+        Wait for an effect layer and its sound to complete.
+
+        :param layer: The effect layer, or None if the pixels are disabled.
+        :param sound: The sound task.
+        """
+        if layer is not None:
+            await layer.wait_async()
+        await sound
+
+    def _effect_route(self, effect: scooteffects.Effect):
+        """
+        Build the route for a declarative effect, playing its compiled frames and its sound.
+
+        :param effect: The effect to play.
+        :return: The request handler.
+        """
+        async def play_effect(request: web.Request) -> web.Response:
+            log.info("Endpoint '/%s': Accessed by %s", effect.name, request.remote)
+            zone = self._zone(request)
+            # compiled at startup, so this is a lookup
+            program = self._effects.program(effect, len(self._pixels.zones[zone]))
+            sound = asyncio.create_task(
+                self._sounds.play_async(self._sounds.load(effect.sound)) if effect.sound else asyncio.sleep(0))
+            await self._effect(self._pixels.play(effect.name, iter(program), zone, effect.blend, wait = False), sound)
+            self._pixels.solid(self._idle_color)
+            log.info("... Endpoint '/%s' complete", effect.name)
+            return web.Response(text = "")
+        return play_effect
+
+    async def index(self, request: web.Request) -> web.Response:
+        """
+        Serve the index page, pre-rendered at startup.
+        """
+        log.info("Endpoint '/': Accessed by %s", request.remote)
+        return self._asset(request, "index.html")
+
+    async def favicon(self, request: web.Request) -> web.Response:
+        """
+        Serve the favicon.ico file.
+        """
+        log.info("Endpoint '/favicon.ico': Accessed by %s", request.remote)
+        return self._asset(request, "images/favicon.ico")
+
+    async def manifest(self, request: web.Request) -> web.Response:
+        """
+        Serve the manifest.json file.
+        """
+        log.info("Endpoint '/manifest.json': Accessed by %s", request.remote)
+        return self._asset(request, "manifest.json")
+
+    async def service_worker(self, request: web.Request) -> web.Response:
+        """
+        Serve the service worker, pre-rendered at startup.
+        """
+        log.info("Endpoint '/sw.js': Accessed by %s", request.remote)
+        return self._asset(request, "sw.js")
+
+    async def static_file(self, request: web.Request) -> web.Response:
+        """
+        Serve a static file. Versioned URLs are cached indefinitely by the client.
+        """
+        return self._asset(request, request.match_info['filename'])
+
+    async def disco(self, request: web.Request) -> web.Response:
+        """
+        Handle the disco route to initiate a disco effect with sound and lights.
+        """
+        log.info("Endpoint '/disco': Accessed by %s", request.remote)
+        zone = self._zone(request)
+        sound = asyncio.create_task(self._sounds.play_async(self._sounds.sound_disco))
+        await self._effect(self._pixels.disco(2, 0.5, zone, wait = False), sound)
+        self._pixels.solid(self._idle_color)
+        log.info("... Endpoint '/disco' complete")
+        return web.Response(text = "")
+
+    async def fireplace(self, request: web.Request) -> web.Response:
+        """
+        Handle the fireplace effect route.
+        """
+        log.info("Endpoint '/fireplace': Accessed by %s", request.remote)
+        zone = self._zone(request)
+        sound = asyncio.create_task(self._sounds.play_async(self._sounds.sound_fireplace))
+        await self._effect(self._pixels.fireplace(zone = zone, wait = False), sound)
+        self._pixels.solid(self._idle_color)
+        log.info("... Endpoint '/fireplace' complete")
+        return web.Response(text = "")
+
+    async def underlight(self, request: web.Request) -> web.Response:
+        """
+        Handle the underlight route to start the underlight effect.
+        """
+        log.info("Endpoint '/underlight': Accessed by %s", request.remote)
+        zone = self._zone(request)
+        sound = asyncio.create_task(self._sounds.play_async(self._sounds.sound_underlight))
+        await self._effect(self._pixels.underlight(zone = zone, wait = False), sound)
+        self._pixels.solid(self._idle_color)
+        log.info("... Endpoint '/underlight' complete")
+        return web.Response(text = "")
+
+    async def energyweapon(self, request: web.Request) -> web.Response:
+        """
+        Handle the energyweapon effect route.
+        """
+        log.info("Endpoint '/energyweapon': Accessed by %s", request.remote)
+        zone = self._zone(request)
+        sound = asyncio.create_task(self._sounds.play_async(self._sounds.sound_energyweapon))
+        await self._effect(self._pixels.energyweapon(zone, wait = False), sound)
+        self._pixels.solid(self._idle_color)
+        log.info("... Endpoint '/energyweapon' complete")
+        return web.Response(text = "")
+
+    async def meltdown(self, request: web.Request) -> web.Response:
+        """
+        Handle the meltdown route to perform the meltdown effect with flashing lights.
+        """
+        log.info("Endpoint '/meltdown': Accessed by %s", request.remote)
+        for count in range(3):
+            sound = asyncio.create_task(self._sounds.play_async(self._sounds.sound_meltdown))
+            layer = self._pixels.flash((255, 255, 255), 2, wait = False)
+            if layer is not None:
+                await layer.wait_async()
+            await self._effect(self._pixels.flash((255, 0, 0), 1, wait = False), sound)
+        self._pixels.solid(self._idle_color)
+        log.info("... Endpoint '/meltdown' complete")
+        return web.Response(text = "")
+
+    async def color(self, request: web.Request) -> web.Response:
+        """
+        Handle the color route to set pixels to a user-specified color.
+        """
+        log.info("Endpoint '/color': Accessed by %s", request.remote)
+        idle_color = "#{:02x}{:02x}{:02x}".format(*self._idle_color)
+        hex_color = request.query.get('rgb', idle_color)
+        # Check if the hex color starts with '#', and remove it
+        if hex_color.startswith('#'):
+            hex_color = hex_color[1:]
+
+        # Check if the remaining string is 6 hexadecimal digits
+        if len(hex_color) != 6 or not all(c in '0123456789abcdefABCDEF' for c in hex_color):
+            log.warning("Invalid hex color. Must be 6 hexadecimal characters long.")
+            raise web.HTTPBadRequest()
+
+        log.info("Color selected: %s", hex_color)
+        self._pixels.solid(tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4)))
+        log.info("... Endpoint '/color' complete")
+        return web.Response(text = "")
+
+    async def lights_out(self, request: web.Request) -> web.Response:
+        """
+        Handle the lights-out route to turn off all lights.
+        """
+        log.info("Endpoint '/lights-out': Accessed by %s", request.remote)
+        await self._sounds.play_async(self._sounds.sound_lights_out)
+        self._pixels.off()
+        log.info("... Endpoint '/lights-out' complete")
+        return web.Response(text = "")
+
+    async def speedlights_mode(self, request: web.Request) -> web.Response:
+        """
+        Handle the speedlights route to start or stop speed-reactive lighting.
+        """
+        log.info("Endpoint '/speedlights': Accessed by %s", request.remote)
+        zone = self._zone(request) if 'zone' in request.query else self._speedlights_zone
+        mode = request.query.get('mode', scootspeedlights.MODE_BAR)
+        if mode == "off":
+            self._speedlights.stop()
+        elif mode in scootspeedlights.MODES:
+            self._speedlights.start(mode, zone)
+        else:
+            log.warning("Unknown speed lights mode '%s'.", mode)
+            raise web.HTTPBadRequest()
+        log.info("... Endpoint '/speedlights' complete")
+        return web.Response(text = "")
+
+    async def pixels_stats(self, request: web.Request) -> web.Response:
+        """
+        Report LED output statistics.
+        """
+        log.info("Endpoint '/pixels': Accessed by %s", request.remote)
+        return web.json_response(self._pixels.stats())
+
+    async def odometer_stats(self, request: web.Request) -> web.Response:
+        """
+        Report the delay from odometer pulses to their handling.
+        """
+        log.info("Endpoint '/odometer': Accessed by %s", request.remote)
+        return web.json_response(self._odometer.stats())
+
+    async def latency(self, request: web.Request) -> web.Response:
+        """
+        Report the pulse-to-photon latency of speed-reactive lighting.
+        """
+        log.info("Endpoint '/latency': Accessed by %s", request.remote)
+        return web.json_response(self._speedlights.latency())
+
+    async def debug_log(self, request: web.Request) -> web.Response:
+        """
+        Report the most recent log events. The number of events and the lowest level may be given
+        with the 'count' and 'level' query arguments.
+        """
+        try:
+            count = int(request.query['count']) if 'count' in request.query else None
+            return web.json_response(scootlog.recent(count, request.query.get('level', "NOTSET")))
+        except ValueError as e:
+            log.warning("%s", e)
+            raise web.HTTPBadRequest()
+
+    async def trajectory(self, request: web.Request) -> web.WebSocketResponse:
+        """
+        Stream trajectory data to a websocket client until it disconnects.
+        """
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        log.info("WebSocket client connected from %s: /trajectory", request.remote)
+        messages = asyncio.Queue(maxsize = TRAJECTORY_QUEUE_SIZE)
+        self._trajectory_clients.add(messages)
+        sender = asyncio.create_task(self._trajectory_send(websocket, messages))
+        try:
+            async for _ in websocket:
+                pass  # clients only receive
+        finally:
+            self._trajectory_clients.discard(messages)
+            sender.cancel()
+        return websocket
+
+    @staticmethod
+    async def _trajectory_send(websocket: web.WebSocketResponse, messages: asyncio.Queue):
+        while True:
+            await websocket.send_str(await messages.get())
+
+    def _trajectory_update(self, timestamp: float, position: float, speed: float):
+        """
+        Queue a trajectory sample for every websocket client. Registered as an odometer callback.
+        """
+        message = json.dumps({
+            'timestamp': math.ceil(timestamp * 1000),
+            'position': position / self._pulses_per_foot,
+            'speed': speed / self._pulses_per_foot})
+        for messages in self._trajectory_clients:
+            if messages.full():
+                messages.get_nowait()
+            messages.put_nowait(message)
@@ -0,0 +1,367 @@
+import collections
+import logging
+import time
+
+import numpy as np
+
+import raspi_detect
+import scootthreads
+
+if raspi_detect.is_raspi:
+    import neopixel
+    from rpi_ws281x import ws
+
+# LED writes block in C for the wire time, in the native threads of the output stage and the
+# channel group. The simulated wire time must block a native thread the same way under gevent
+try:
+    from gevent import monkey
+    _sleep = monkey.get_original('time', 'sleep')
+except ImportError:
+    _sleep = time.sleep
+
+# WS281x wire timing: 24 bits per pixel at 800 kHz, then a latch
+WS281X_BIT_S = 1.25e-6
+WS281X_BITS_PER_PIXEL = 24
+WS281X_RESET_S = 50e-6
+
+# rpi_ws281x peripheral and channel for each GPIO pin able to drive WS281x LEDs.
+# PWM0: GPIO 12, 18; PWM1: GPIO 13, 19; PCM: GPIO 21; SPI: GPIO 10
+# The two PWM channels belong to one peripheral, so are driven together as one output.
+WS281X_PIN_OUTPUTS = {12: ("PWM", 0), 18: ("PWM", 0), 13: ("PWM", 1), 19: ("PWM", 1), 21: ("PCM", 0), 10: ("SPI", 0)}
+# first DMA channel; each output uses its own
+WS281X_DMA_BASE = 10
+
+log = logging.getLogger(__name__)
+
+
+class PixelChannel:
+    """
+    One physical LED output, driving a segment of the logical strip.
+    Subclasses implement _write() to push a frame over the wire.
+
+    Attributes:
+        name (str): The name of the channel, used for reporting.
+        length (int): The number of pixels on the channel.
+    """
+
+    def __init__(self, name: str, length: int, fps_window: int = 100):
+        """
+        Initialize the channel.
+
+        :param name: The name of the channel, used for reporting.
+        :param length: The number of pixels on the channel.
+        :param fps_window: The number of recent frames over which the frame rate is measured.
+        """
+        self.name = name
+        self.length = length
+        self._frames = 0
+        self._write_s = 0.0
+        self._frame_times = collections.deque(maxlen = fps_window)
+
+    def write(self, frame: np.ndarray):
+        """
+        Push a frame to the LEDs, blocking until written, and record timing.
+
+        :param frame: uint8 array of shape (length, 3).
+        """
+        start = time.monotonic()
+        self._write(frame)
+        end = time.monotonic()
+        self._frames += 1
+        self._write_s += end - start
+        self._frame_times.append(end)
+
+    def _write(self, frame: np.ndarray):
+        raise NotImplementedError
+
+    def deinit(self):
+        """
+        Release the output.
+        """
+        pass
+
+    def stats(self) -> dict:
+        """
+        Report the achieved frame rate and write time of the channel.
+
+        :return: A dictionary with the number of pixels and frames written, the frame rate over
+                 the recent frames, and the mean time per write.
+        """
+        fps = 0.0
+        if len(self._frame_times) > 1:
+            elapsed = self._frame_times[-1] - self._frame_times[0]
+            if elapsed > 0:
+                fps = (len(self._frame_times) - 1) / elapsed
+        return {
+            'pixels': self.length,
+            'frames': self._frames,
+            'fps': round(fps, 1),
+            'write_ms': round(self._write_s / self._frames * 1000, 3) if self._frames else 0.0,
+        }
+
+
+class NeoPixelChannel(PixelChannel):
+    """
+    A channel driven by the Adafruit NeoPixel library. Only one such channel may be used at a time.
+    """
+
+    def __init__(self, pin, length: int):
+        """
+        Initialize the NeoPixel output.
+
+        :param pin: The GPIO pin where the NeoPixel LEDs are connected, i.e. board.D18.
+        :param length: The number of pixels on the channel.
+        """
+        super().__init__(f"GPIO{getattr(pin, 'id', pin)}", length)
+        self._pixels = neopixel.NeoPixel(pin = pin, n = length, auto_write = False)
+
+    def _write(self, frame: np.ndarray):
+        self._pixels[:] = frame.tolist()
+        self._pixels.show()
+
+    def deinit(self):
+        self._pixels.deinit()
+
+
+class Ws281xChannel(PixelChannel):
+    """
+    An output driven directly by rpi_ws281x, which allows PWM, PCM and SPI outputs to run together.
+    A PWM output may drive both PWM channels, which are written together by one DMA transfer;
+    the frame is then the pixels of the first channel followed by those of the second.
+    """
+
+    def __init__(self, pins: list, dma: int):
+        """
+        Initialize the rpi_ws281x output.
+
+        :param pins: The GPIO pins of one output, as a list of (pin, length), i.e. [(board.D18, 82)].
+        :param dma: The DMA channel, unique for each output.
+        """
+        super().__init__("+".join(f"GPIO{_gpio(pin)}" for pin, _ in pins), sum(length for _, length in pins))
+        self._leds = ws.new_ws2811_t()
+        for index in range(2):
+            channel = ws.ws2811_channel_get(self._leds, index)
+            ws.ws2811_channel_t_count_set(channel, 0)
+            ws.ws2811_channel_t_gpionum_set(channel, 0)
+            ws.ws2811_channel_t_invert_set(channel, 0)
+            ws.ws2811_channel_t_brightness_set(channel, 0)
+        self._channels = []
+        for pin, length in pins:
+            channel = ws.ws2811_channel_get(self._leds, WS281X_PIN_OUTPUTS[_gpio(pin)][1])
+            ws.ws2811_channel_t_count_set(channel, length)
+            ws.ws2811_channel_t_gpionum_set(channel, _gpio(pin))
+            ws.ws2811_channel_t_brightness_set(channel, 255)
+            ws.ws2811_channel_t_strip_type_set(channel, ws.WS2811_STRIP_GRB)
+            self._channels.append((channel, length))
+        ws.ws2811_t_freq_set(self._leds, 800000)
+        ws.ws2811_t_dmanum_set(self._leds, dma)
+        result = ws.ws2811_init(self._leds)
+        if result != ws.WS2811_SUCCESS:
+            ws.delete_ws2811_t(self._leds)
+            raise RuntimeError(f"rpi_ws281x init failed for {self.name}: {ws.ws2811_get_return_t_str(result)}")
+
+    def _write(self, frame: np.ndarray):
+        # pack to 0xRRGGBB; the library reorders to the strip's byte order
+        packed = (frame[:, 0].astype(np.uint32) << 16) | (frame[:, 1].astype(np.uint32) << 8) | frame[:, 2]
+        offset = 0
+        for channel, length in self._channels:
+            for pixel, color in enumerate(packed[offset:offset + length].tolist()):
+                ws.ws2811_led_set(channel, pixel, color)
+            offset += length
+        result = ws.ws2811_render(self._leds)
+        if result != ws.WS2811_SUCCESS:
+            raise RuntimeError(f"rpi_ws281x render failed for {self.name}: {ws.ws2811_get_return_t_str(result)}")
+
+    def deinit(self):
+        ws.ws2811_fini(self._leds)
+        ws.delete_ws2811_t(self._leds)
+
+
+class SimulatedChannel(PixelChannel):
+    """
+    A channel which models the WS281x wire time without hardware, for testing and benchmarking.
+
+    Attributes:
+        frame (np.ndarray): The last frame written.
+    """
+
+    def __init__(self, name: str, length: int, wire_length: int = None):
+        """
+        Initialize the simulated output.
+
+        :param name: The name of the channel, used for reporting.
+        :param length: The number of pixels on the channel.
+        :param wire_length: The number of pixels sent one after another, which sets the wire time.
+                            Defaults to length; less for both PWM channels, which are sent side by side.
+        """
+        super().__init__(name, length)
+        self.frame = np.zeros((length, 3), dtype = np.uint8)
+        self._wire_s = (wire_length or length) * WS281X_BITS_PER_PIXEL * WS281X_BIT_S + WS281X_RESET_S
+
+    def _write(self, frame: np.ndarray):
+        self.frame = frame.copy()
+        # blocks the thread, as the hardware write does
+        _sleep(self._wire_s)
+
+
+class ChannelGroup:
+    """
+    Several channels treated as one logical strip. Each channel drives some of the pixels of the strip,
+    and the channels are written concurrently from native threads, one per channel. A single channel
+    is written from the calling thread.
+    """
+
+    def __init__(self, channels: list):
+        """
+        Initialize the group and start the channel threads.
+
+        :param channels: The channels of the logical strip, as a list of (channel, pixels) with pixels
+                         a slice or an array of the indices of the pixels driven by the channel.
+        """
+        self._channels = channels
+        self._threads = []
+        if len(channels) > 1:
+            # per channel: the segment to write, or None to stop, and signals to start and report the write
+            self._segments = [None] * len(channels)
+            self._start = [scootthreads.Signal() for _ in channels]
+            self._written = [scootthreads.Signal() for _ in channels]
+            self._threads = [scootthreads.Thread(lambda index = index: self._run(index), f"channel {channel.name}")
+                             for index, (channel, _) in enumerate(channels)]
+            for thread in self._threads:
+                thread.start()
+
+    def write(self, frame: np.ndarray):
+        """
+        Write a frame of the logical strip, blocking until every channel has been written.
+        A channel failing to write is logged, and does not affect the other channels.
+
+        :param frame: uint8 array of shape (pixel count, 3).
+        """
+        if not self._threads:
+            for channel, pixels in self._channels:
+                self._write(channel, frame[pixels])
+            return
+        for index, (_, pixels) in enumerate(self._channels):
+            self._segments[index] = frame[pixels]
+            self._start[index].set()
+        for written in self._written:
+            written.wait()
+
+    def _run(self, index: int):
+        """
+        Write the segments of one channel until stopped.
+
+        :param index: The index of the channel.
+        """
+        channel, _ = self._channels[index]
+        while True:
+            self._start[index].wait()
+            segment = self._segments[index]
+            if segment is None:
+                return
+            self._write(channel, segment)
+            self._written[index].set()
+
+    @staticmethod
+    def _write(channel: PixelChannel, segment: np.ndarray):
+        try:
+            channel.write(segment)
+        except Exception:
+            log.exception("Error writing to channel %s", channel.name)
+
+    def deinit(self):
+        """
+        Stop the channel threads and release every channel.
+        """
+        for index, thread in enumerate(self._threads):
+            self._segments[index] = None
+            self._start[index].set()
+            thread.join()
+        self._threads = []
+        for channel, _ in self._channels:
+            channel.deinit()
+
+    def stats(self) -> dict:
+        """
+        Report the statistics of every channel.
+
+        :return: Channel statistics by channel name.
+        """
+        return {channel.name: channel.stats() for channel, _ in self._channels}
+
+
+def _gpio(pin) -> int:
+    """
+    :return: The GPIO number of a pin, given as i.e. board.D18 or 18.
+    """
+    return getattr(pin, 'id', pin)
+
+
+def _pixels(segments: list):
+    """
+    :param segments: Segments of the logical strip, as a list of (pin, start, stop).
+    :return: The pixels of the segments, in order, as a slice or an array of indices.
+    """
+    if len(segments) == 1:
+        _, start, stop = segments[0]
+        return slice(start, stop)
+    return np.concatenate([np.arange(start, stop) for _, start, stop in segments])
+
+
+def ws281x_outputs(segments: list) -> list:
+    """
+    Group segments of the logical strip by rpi_ws281x output. Segments on the two PWM channels
+    form one output, as they share the PWM peripheral; PCM and SPI are outputs of their own.
+
+    :param segments: Segments of the logical strip, as a list of (pin, start, stop).
+    :return: Outputs as a list of lists of segments.
+    :raises ValueError: If a pin cannot drive WS281x LEDs, or two segments use the same channel,
+                        such as GPIO 12 and 18, which are both PWM channel 0.
+    """
+    outputs = {}
+    used = {}
+    for pin, start, stop in segments:
+        gpio = _gpio(pin)
+        if gpio not in WS281X_PIN_OUTPUTS:
+            raise ValueError(f"GPIO {gpio} cannot drive WS281x LEDs")
+        peripheral, channel = WS281X_PIN_OUTPUTS[gpio]
+        if (peripheral, channel) in used:
+            raise ValueError(f"GPIO {gpio} and GPIO {used[peripheral, channel]} both use {peripheral} channel {channel}")
+        used[peripheral, channel] = gpio
+        outputs.setdefault(peripheral, []).append((pin, start, stop))
+    return list(outputs.values())
+
+
+def hardware_channels(segments: list) -> list:
+    """
+    Create hardware channels for segments of the logical strip. A single segment uses the
+    NeoPixel library; several segments use rpi_ws281x directly, each output with its own DMA channel.
+
+    :param segments: Segments of the logical strip, as a list of (pin, start, stop).
+    :return: Channels as a list of (channel, pixels), for a ChannelGroup.
+    """
+    if len(segments) == 1:
+        pin, start, stop = segments[0]
+        return [(NeoPixelChannel(pin, stop - start), slice(start, stop))]
+    return [(Ws281xChannel([(pin, stop - start) for pin, start, stop in output], WS281X_DMA_BASE + index),
+             _pixels(output))
+            for index, output in enumerate(ws281x_outputs(segments))]
+
+
+def simulated_channels(segments: list) -> list:
+    """
+    Create simulated channels for segments of the logical strip, grouped into outputs as on
+    the hardware if the pins can drive WS281x LEDs.
+
+    :param segments: Segments of the logical strip, as a list of (pin, start, stop).
+    :return: Channels as a list of (channel, pixels), for a ChannelGroup.
+    """
+    try:
+        outputs = ws281x_outputs(segments)
+    except ValueError:
+        outputs = [[segment] for segment in segments]
+    return [(SimulatedChannel("+".join(f"sim{_gpio(pin)}" for pin, _, _ in output),
+                              sum(stop - start for _, start, stop in output),
+                              max(stop - start for _, start, stop in output)),
+             _pixels(output))
+            for output in outputs]
@@ -0,0 +1,384 @@
+import asyncio
+import threading
+import time
+from typing import Callable, Iterator
+
+import numpy as np
+
+import scootthreads
+
+# Blend modes, applied in place to the frame below the layer
+BLEND_ALPHA = "alpha"  # layer over the frame below, weighted by the layer alpha
+BLEND_ADD = "add"      # layer added to the frame below, saturating
+BLEND_MAX = "max"      # per-channel maximum of the layer and the frame below
+
+
+def _blend_alpha(below: np.ndarray, rgb: np.ndarray, alpha: np.ndarray):
+    below += (rgb - below) * alpha
+
+def _blend_add(below: np.ndarray, rgb: np.ndarray, alpha: np.ndarray):
+    below += rgb * alpha
+    np.minimum(below, 255.0, out = below)
+
+def _blend_max(below: np.ndarray, rgb: np.ndarray, alpha: np.ndarray):
+    np.maximum(below, rgb * alpha, out = below)
+
+BLEND_MODES = {
+    BLEND_ALPHA: _blend_alpha,
+    BLEND_ADD: _blend_add,
+    BLEND_MAX: _blend_max,
+}
+
+
+class Zone:
+    """
+    A named, contiguous range of pixels on the strip.
+
+    Attributes:
+        name (str): The name of the zone.
+        start (int): Index of the first pixel in the zone.
+        stop (int): Index one past the last pixel in the zone.
+    """
+
+    def __init__(self, name: str, start: int, stop: int):
+        """
+        Initialize the zone with a pixel index range.
+
+        :param name: The name of the zone.
+        :param start: Index of the first pixel in the zone.
+        :param stop: Index one past the last pixel in the zone.
+        """
+        self.name = name
+        self.start = start
+        self.stop = stop
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    @property
+    def slice(self) -> slice:
+        """
+        Slice selecting the zone from a frame of the whole strip.
+        """
+        return slice(self.start, self.stop)
+
+
+class Layer:
+    """
+    An effect rendered into a zone and blended over the layers below it.
+
+    Frames are drawn from an iterator yielding (frame, hold_s) tuples, where frame is a uint8 array
+    of shape (zone length, 3) for RGB or (zone length, 4) for RGBA, held for hold_s seconds.
+    The layer finishes when the iterator is exhausted. Overdue frames are skipped so that
+    the effect keeps its duration, except the last frame, which is always shown.
+
+    Attributes:
+        name (str): The name of the layer. Adding a layer replaces any layer with the same name.
+        zone (Zone): The zone the layer renders into.
+        blend (str): The blend mode, one of BLEND_ALPHA, BLEND_ADD or BLEND_MAX.
+        opacity (float): Opacity of the whole layer, between 0 and 1.
+        priority (int): Layers are blended in order of increasing priority.
+        finished (threading.Event): Set once the layer has finished or was removed.
+        started (float): Monotonic time the layer was first rendered, or None.
+    """
+
+    def __init__(self,
+                 name: str,
+                 zone: Zone,
+                 frames: Iterator,
+                 blend: str = BLEND_ALPHA,
+                 opacity: float = 1.0,
+                 priority: int = 0):
+        """
+        Initialize the layer.
+
+        :param name: The name of the layer.
+        :param zone: The zone the layer renders into.
+        :param frames: Iterator yielding (frame, hold_s) tuples.
+        :param blend: The blend mode, one of BLEND_ALPHA, BLEND_ADD or BLEND_MAX.
+        :param opacity: Opacity of the whole layer, between 0 and 1.
+        :param priority: Layers are blended in order of increasing priority.
+        """
+        if blend not in BLEND_MODES:
+            raise ValueError(f"Unknown blend mode '{blend}'")
+        self.name = name
+        self.zone = zone
+        self.blend = blend
+        self.opacity = opacity
+        self.priority = priority
+        self.finished = threading.Event()
+        self.started = None
+        self._done_callbacks = []
+        self._done_lock = threading.Lock()
+        self._frames = iter(frames)
+        self._frame = None
+        self._frame_shown = False
+        self._deadline = None
+
+    def finish(self):
+        """
+        Mark the layer as finished, and issue the done callbacks.
+        """
+        with self._done_lock:
+            if self.finished.is_set():
+                return
+            self.finished.set()
+            callbacks, self._done_callbacks = self._done_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_done_callback(self, callback: Callable[[], None]):
+        """
+        Register a callback to be issued once the layer has finished, from the thread finishing it.
+        Issued immediately if the layer has already finished.
+
+        :param callback: method with signature () -> None
+        """
+        with self._done_lock:
+            if not self.finished.is_set():
+                self._done_callbacks.append(callback)
+                return
+        callback()
+
+    async def wait_async(self):
+        """
+        Wait on the running event loop until the layer has finished.
+        """
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+        self.add_done_callback(lambda: loop.call_soon_threadsafe(
+            lambda: done.done() or done.set_result(None)))
+        await done
+
+    def render(self, now: float) -> np.ndarray:
+        """
+        Advance to the frame due at the given time.
+
+        :param now: The current monotonic time, in seconds.
+        :return: The current frame, or None if the layer has finished.
+        """
+        if self.finished.is_set():
+            return None
+        try:
+            if self._deadline is None:
+                self.started = now
+                self._frame, hold_s = next(self._frames)
+                self._deadline = now + hold_s
+            # skip frames which are already overdue, so the effect keeps its duration
+            while now >= self._deadline:
+                frame, hold_s = next(self._frames)
+                self._frame, self._frame_shown = frame, False
+                self._deadline += hold_s
+        except StopIteration:
+            # show the last frame once, however short its hold
+            if self._frame is None or self._frame_shown:
+                self.finish()
+                return None
+        self._frame_shown = True
+        return self._frame
+
+
+class LiveLayer(Layer):
+    """
+    A layer rendered from live data, such as the current speed. Rendered anew on every frame
+    rather than drawn from a precomputed sequence. The layer runs until removed.
+    """
+
+    def __init__(self,
+                 name: str,
+                 zone: Zone,
+                 render: Callable[[float], np.ndarray],
+                 blend: str = BLEND_ALPHA,
+                 opacity: float = 1.0,
+                 priority: int = 0):
+        """
+        Initialize the layer.
+
+        :param name: The name of the layer.
+        :param zone: The zone the layer renders into.
+        :param render: Called with the current monotonic time, returns an RGB or RGBA frame sized to the zone.
+        :param blend: The blend mode, one of BLEND_ALPHA, BLEND_ADD or BLEND_MAX.
+        :param opacity: Opacity of the whole layer, between 0 and 1.
+        :param priority: Layers are blended in order of increasing priority.
+        """
+        super().__init__(name, zone, (), blend, opacity, priority)
+        self._render = render
+
+    def render(self, now: float) -> np.ndarray:
+        """
+        Render the frame for the given time.
+
+        :param now: The current monotonic time, in seconds.
+        :return: The current frame, or None if the layer was removed.
+        """
+        if self.finished.is_set():
+            return None
+        return self._render(now)
+
+
+class Compositor:
+    """
+    Blends effect layers into a single frame per tick and writes it to one output,
+    so concurrent effects in different zones cost one strip update rather than competing writers.
+
+    Attributes:
+        zones (dict): Zones by name. Always contains 'all', covering the whole strip.
+        fps (float): The maximum number of frames output per second.
+    """
+
+    def __init__(self,
+                 pixel_count: int,
+                 output: Callable[[np.ndarray, str], None],
+                 zones: dict = None,
+                 fps: float = 100.0):
+        """
+        Initialize the compositor with a black background.
+
+        :param pixel_count: The number of pixels on the strip.
+        :param output: Called with each composited uint8 frame of shape (pixel_count, 3), and the
+                       names of the effects drawn in it.
+        :param zones: Pixel index ranges by zone name, as {name: (start, stop)}.
+        :param fps: The maximum number of frames output per second.
+        """
+        self.zones = {"all": Zone("all", 0, pixel_count)}
+        for name, (start, stop) in (zones or {}).items():
+            if not 0 <= start < stop <= pixel_count:
+                raise ValueError(f"Zone '{name}' ({start}, {stop}) is outside of the strip")
+            self.zones[name] = Zone(name, start, stop)
+        self.fps = fps
+        self._pixel_count = pixel_count
+        self._output = output
+        self._background = np.zeros((pixel_count, 3), dtype = np.float32)
+        self._layers = []
+        self._lock = scootthreads.allocate_lock()
+        self._wake = scootthreads.Signal()
+        self._dirty = True
+        self._running = False
+        self._thread = scootthreads.Thread(self._run, "compositor")
+
+    def start(self):
+        """
+        Start compositing in a native daemon thread, so that frames keep their timing under gevent.
+        """
+        self._running = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop compositing, and finish all layers.
+        """
+        self._running = False
+        self._wake.set()
+        self._thread.join()
+        with self._lock:
+            for layer in self._layers:
+                layer.finish()
+            self._layers = []
+
+    def background(self, color: tuple):
+        """
+        Set the color shown wherever no layer is drawn.
+
+        :param color: The background color.
+        """
+        with self._lock:
+            self._background[:] = color
+            self._dirty = True
+        self._wake.set()
+
+    def add_layer(self, layer: Layer) -> Layer:
+        """
+        Add a layer, replacing any layer with the same name.
+
+        :param layer: The layer to add.
+        :return: The added layer.
+        """
+        with self._lock:
+            for existing in self._layers:
+                if existing.name == layer.name:
+                    existing.finish()
+            self._layers = [existing for existing in self._layers if existing.name != layer.name]
+            self._layers.append(layer)
+            # stable sort: equal priorities blend in the order added
+            self._layers.sort(key = lambda existing: existing.priority)
+        self._wake.set()
+        return layer
+
+    def layers(self) -> list:
+        """
+        The layers being composited, in blending order.
+
+        :return: A list of layers.
+        """
+        with self._lock:
+            return list(self._layers)
+
+    def remove_layer(self, name: str):
+        """
+        Remove a layer, if present.
+
+        :param name: The name of the layer.
+        """
+        with self._lock:
+            for existing in self._layers:
+                if existing.name == name:
+                    existing.finish()
+            self._layers = [existing for existing in self._layers if existing.name != name]
+            self._dirty = True
+        self._wake.set()
+
+    def wake(self):
+        """
+        Composite the next frame immediately rather than waiting for the next tick.
+        """
+        self._wake.set()
+
+    def compose(self, now: float) -> (np.ndarray, tuple):
+        """
+        Blend the background and all layers into one frame. Finished layers are removed.
+
+        :param now: The current monotonic time, in seconds.
+        :return: A tuple containing the composited uint8 frame of shape (pixel_count, 3), and the
+                 names of the layers drawn in it, or ('background',) if none.
+        """
+        with self._lock:
+            frame = self._background.copy()
+            layers = list(self._layers)
+            self._dirty = False
+
+        finished = False
+        drawn = []
+        for layer in layers:
+            layer_frame = layer.render(now)
+            if layer_frame is None:
+                finished = True
+                continue
+            drawn.append(layer.name)
+            rgb = layer_frame[:, :3].astype(np.float32)
+            if layer_frame.shape[1] == 4:
+                alpha = layer_frame[:, 3:4].astype(np.float32) * (layer.opacity / 255.0)
+            else:
+                alpha = np.float32(layer.opacity)
+            BLEND_MODES[layer.blend](frame[layer.zone.slice], rgb, alpha)
+
+        if finished:
+            with self._lock:
+                self._layers = [layer for layer in self._layers if not layer.finished.is_set()]
+                # show the frame below the finished layers even if nothing else changes
+                self._dirty = True
+        return np.clip(frame, 0.0, 255.0).astype(np.uint8), tuple(drawn) or ("background",)
+
+    def _run(self):
+        """
+        Composite and output frames until stopped. Idles while there are no layers and nothing changed.
+        """
+        period_s = 1.0 / self.fps
+        while self._running:
+            tick = time.monotonic()
+            if self._layers or self._dirty:
+                self._output(*self.compose(tick))
+            if self._layers:
+                timeout = max(0.0, period_s - (time.monotonic() - tick))
+            else:
+                timeout = None
+            self._wake.wait(timeout)
@@ -0,0 +1,358 @@
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import Iterator
+
+import numpy as np
+
+import scootcompositor
+
+# Frame rate of compiled effects, unless given by the definition
+EFFECT_FPS = 50.0
+# Effect names, which are also their routes
+EFFECT_NAME_PATTERN = re.compile(r"^[a-z0-9][a-z0-9-]*$")
+
+# Interpolation between keyframes
+EASING_LINEAR = "linear"  # constant rate
+EASING_SMOOTH = "smooth"  # slow in and out
+EASING_STEP = "step"      # hold each keyframe until the next
+EASINGS = (EASING_LINEAR, EASING_SMOOTH, EASING_STEP)
+
+# Version of the compiled program format, part of each program's hash; change it when compile() changes
+PROGRAM_VERSION = 1
+
+log = logging.getLogger(__name__)
+
+
+class EffectError(ValueError):
+    """
+    Raised for an invalid effect definition.
+    """
+    pass
+
+
+def _color(value, effect: str) -> list:
+    """
+    Parse a color as "#rrggbb", "#rrggbbaa", [r, g, b] or [r, g, b, a].
+
+    :return: The color as [r, g, b, a], each 0 to 255.
+    """
+    if isinstance(value, str) and re.fullmatch(r"#([0-9a-fA-F]{6}|[0-9a-fA-F]{8})", value):
+        channels = [int(value[i:i + 2], 16) for i in range(1, len(value), 2)]
+    elif isinstance(value, list) and len(value) in (3, 4) and \
+            all(isinstance(channel, (int, float)) and 0 <= channel <= 255 for channel in value):
+        channels = list(value)
+    else:
+        raise EffectError(f"Effect '{effect}': invalid color {value!r}")
+    return channels + [255] * (4 - len(channels))
+
+
+def _gradient(stops: list, effect: str) -> (np.ndarray, np.ndarray):
+    """
+    Parse a gradient, as a list of colors spaced evenly along the zone,
+    or a list of [position, color] stops with positions from 0 to 1.
+
+    :return: A tuple containing the stop positions and the stop colors as an array of shape (stops, 4).
+    """
+    if not isinstance(stops, list) or not stops:
+        raise EffectError(f"Effect '{effect}': a gradient must be a non-empty list")
+    if all(isinstance(stop, list) and len(stop) == 2 and isinstance(stop[0], (int, float)) for stop in stops):
+        positions = [float(stop[0]) for stop in stops]
+        colors = [_color(stop[1], effect) for stop in stops]
+        if positions != sorted(positions) or positions[0] < 0 or positions[-1] > 1:
+            raise EffectError(f"Effect '{effect}': gradient positions must increase from 0 to 1")
+    else:
+        positions = list(np.linspace(0.0, 1.0, len(stops))) if len(stops) > 1 else [0.0]
+        colors = [_color(stop, effect) for stop in stops]
+    return np.array(positions), np.array(colors, dtype = np.float32)
+
+
+def _number(values: dict, key: str, default: float, effect: str) -> float:
+    """
+    Read a number from a definition.
+
+    :return: The number, or the default if not given.
+    """
+    value = values.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise EffectError(f"Effect '{effect}': '{key}' must be a number")
+    return float(value)
+
+
+class FrameProgram:
+    """
+    A compiled effect for one zone length: frames to show, each with the time to hold it.
+    Consecutive identical frames are merged into one longer hold.
+
+    Attributes:
+        frames (np.ndarray): uint8 array of shape (frame count, zone length, 3 or 4).
+        holds (np.ndarray): Time to hold each frame, in seconds.
+        repeat (int): The number of times the frames are played.
+    """
+
+    def __init__(self, frames: np.ndarray, holds: np.ndarray, repeat: int = 1):
+        self.frames = frames
+        self.holds = holds
+        self.repeat = repeat
+
+    def __iter__(self) -> Iterator[tuple]:
+        """
+        Iterate the frames as (frame, hold_s) tuples, as played by a compositor layer.
+        """
+        for _ in range(self.repeat):
+            yield from zip(self.frames, self.holds.tolist())
+
+    def resume(self, elapsed_s: float) -> Iterator[tuple]:
+        """
+        Iterate the frames from a time into the program, such as to resume an effect after a restart.
+
+        :param elapsed_s: The time into the program, in seconds.
+        """
+        for frame, hold_s in self:
+            if elapsed_s < hold_s:
+                yield frame, hold_s - elapsed_s
+                elapsed_s = 0.0
+            else:
+                elapsed_s -= hold_s
+
+    @property
+    def duration_s(self) -> float:
+        return float(self.holds.sum()) * self.repeat
+
+
+class Effect:
+    """
+    A light show defined as data: keyframed gradients, optionally in motion, with an optional sound.
+
+    Attributes:
+        name (str): The name of the effect, also its route.
+        label (str): The text of the effect's button.
+        button (str): Image of the effect's button, relative to the static directory, or None.
+        sound (str): Sound played with the effect, relative to the sounds directory, or None.
+        blend (str): The blend mode of the effect layer.
+        digest (str): Hash of the definition, which identifies its compiled programs.
+    """
+
+    def __init__(self, name: str, definition: dict):
+        """
+        Validate an effect definition.
+
+        :param name: The name of the effect, also its route.
+        :param definition: The parsed definition. See the README for the format.
+        """
+        if not EFFECT_NAME_PATTERN.match(name):
+            raise EffectError(f"Effect '{name}': names may only contain lowercase letters, digits and '-'")
+        if not isinstance(definition, dict):
+            raise EffectError(f"Effect '{name}': the definition must be an object")
+        self.name = name
+        self.label = definition.get('label', name)
+        self.button = definition.get('button')
+        self.sound = definition.get('sound')
+        if not isinstance(self.label, str) or not all(isinstance(path, (str, type(None)))
+                                                      for path in (self.button, self.sound)):
+            raise EffectError(f"Effect '{name}': label, button and sound must be strings")
+        self.blend = definition.get('blend', scootcompositor.BLEND_ALPHA)
+        if not isinstance(self.blend, str) or self.blend not in scootcompositor.BLEND_MODES:
+            raise EffectError(f"Effect '{name}': unknown blend mode '{self.blend}'")
+        self.fps = _number(definition, 'fps', EFFECT_FPS, name)
+        self.repeat = int(_number(definition, 'repeat', 1, name))
+        self.easing = definition.get('easing', EASING_LINEAR)
+        if not isinstance(self.easing, str) or self.easing not in EASINGS:
+            raise EffectError(f"Effect '{name}': unknown easing '{self.easing}'")
+        if self.fps <= 0 or self.repeat < 1:
+            raise EffectError(f"Effect '{name}': fps and repeat must be positive")
+
+        keyframes = definition.get('keyframes')
+        if not isinstance(keyframes, list) or not keyframes:
+            raise EffectError(f"Effect '{name}': at least one keyframe is required")
+        if not all(isinstance(keyframe, dict) for keyframe in keyframes):
+            raise EffectError(f"Effect '{name}': keyframes must be objects")
+        self._times = np.array([_number(keyframe, 'time', 0.0, name) for keyframe in keyframes])
+        if self._times[0] != 0 or np.any(np.diff(self._times) < 0):
+            raise EffectError(f"Effect '{name}': keyframe times must increase from 0")
+        self._gradients = [_gradient(keyframe.get('gradient'), name) for keyframe in keyframes]
+        self.duration_s = _number(definition, 'duration', float(self._times[-1]), name)
+        if self.duration_s < self._times[-1]:
+            raise EffectError(f"Effect '{name}': duration ends before the last keyframe")
+
+        motion = definition.get('motion', {})
+        if not isinstance(motion, dict):
+            raise EffectError(f"Effect '{name}': motion must be an object")
+        self._speed = _number(motion, 'speed', 0.0, name)
+        self._wrap = bool(motion.get('wrap', True))
+
+        canonical = json.dumps(definition, sort_keys = True, separators = (",", ":"))
+        self.digest = hashlib.sha256(f"{PROGRAM_VERSION}:{canonical}".encode()).hexdigest()
+
+    def compile(self, length: int) -> FrameProgram:
+        """
+        Render the effect for a zone length. Rendering is vectorized over all frames at once.
+
+        :param length: The number of pixels in the zone.
+        :return: The compiled frames.
+        """
+        # render a single frame when nothing changes over time
+        static = self.duration_s == 0 or (len(self._times) == 1 and self._speed == 0)
+        count = 1 if static else max(1, int(round(self.duration_s * self.fps)))
+        times = np.arange(count) / self.fps
+
+        # keyframe gradients sampled at the pixel positions: (keyframes, length, 4)
+        positions = (np.arange(length) + 0.5) / length
+        keyframes = np.stack([
+            np.stack([np.interp(positions, stop_positions, colors[:, channel]) for channel in range(4)], axis = 1)
+            for stop_positions, colors in self._gradients]).astype(np.float32)
+
+        # interpolate between the keyframes either side of each frame time
+        if len(self._times) > 1:
+            after = np.clip(np.searchsorted(self._times, times, side = 'right'), 1, len(self._times) - 1)
+            before = after - 1
+        else:
+            before = after = np.zeros(count, dtype = np.int64)
+        span = self._times[after] - self._times[before]
+        weight = np.divide(times - self._times[before], span, out = np.zeros_like(times), where = span > 0)
+        weight = np.clip(weight, 0.0, 1.0)
+        if self.easing == EASING_SMOOTH:
+            weight = weight * weight * (3.0 - 2.0 * weight)
+        elif self.easing == EASING_STEP:
+            weight = np.floor(weight)
+        weight = weight.astype(np.float32)[:, None, None]
+        frames = keyframes[before] * (1.0 - weight) + keyframes[after] * weight
+
+        # move the pattern along the zone, sampling between pixels for smooth motion
+        if self._speed != 0:
+            source = np.arange(length)[None, :] - (self._speed * times)[:, None]
+            if self._wrap:
+                source = np.mod(source, length)
+            lower = np.floor(source).astype(np.int64)
+            fraction = (source - lower).astype(np.float32)[:, :, None]
+            visible = ((lower >= 0) & (lower < length))[:, :, None]
+            rows = np.arange(count)[:, None]
+            lower_pixels = frames[rows, np.mod(lower, length)]
+            upper_pixels = frames[rows, np.mod(lower + 1, length)]
+            if not self._wrap:
+                upper_pixels = np.where(((lower + 1) < length)[:, :, None], upper_pixels, 0.0)
+            frames = np.where(visible, lower_pixels * (1.0 - fraction) + upper_pixels * fraction, 0.0)
+
+        frames = np.round(frames).astype(np.uint8)
+        if np.all(frames[:, :, 3] == 255):
+            frames = np.ascontiguousarray(frames[:, :, :3])
+
+        # merge runs of identical frames into single frames held for longer
+        changed = np.ones(count, dtype = bool)
+        changed[1:] = np.any(frames[1:] != frames[:-1], axis = (1, 2))
+        starts = np.flatnonzero(changed)
+        holds = np.diff(np.append(starts, count)) / self.fps
+        if static:
+            holds = np.array([self.duration_s])
+        return FrameProgram(frames[starts], holds, self.repeat)
+
+
+class EffectLibrary:
+    """
+    Effects loaded from definition files, compiled ahead of time for each zone length.
+    Compiled programs are cached by the hash of their definition, in memory and optionally on disk,
+    so an unchanged definition is only ever compiled once.
+    """
+
+    def __init__(self, effects_dir: str, cache_dir: str = None):
+        """
+        Initialize an empty library.
+
+        :param effects_dir: Directory from which the *.json effect definitions are loaded.
+        :param cache_dir: Directory in which compiled programs are kept across restarts. Defaults to none.
+        """
+        self.effects_dir = effects_dir
+        self.cache_dir = cache_dir
+        self._effects = {}
+        self._programs = {}
+
+    def load(self, reserved: tuple = ()):
+        """
+        Read every effect definition. Invalid definitions are logged and skipped.
+
+        :param reserved: Names which may not be used by effects, such as existing routes.
+        """
+        if not os.path.isdir(self.effects_dir):
+            return
+        for file in sorted(os.listdir(self.effects_dir)):
+            name, extension = os.path.splitext(file)
+            if extension != ".json":
+                continue
+            try:
+                if name in reserved:
+                    raise EffectError(f"Effect '{name}': name is reserved")
+                with open(os.path.join(self.effects_dir, file)) as definition_file:
+                    self._effects[name] = Effect(name, json.load(definition_file))
+            except (OSError, ValueError) as e:
+                log.error("Skipping effect definition %s: %s", file, e)
+
+    def __iter__(self) -> Iterator[Effect]:
+        return iter(self._effects.values())
+
+    def get(self, name: str) -> Effect:
+        """
+        Retrieve an effect by name.
+
+        :return: The effect, or None if there is no such effect.
+        """
+        return self._effects.get(name)
+
+    def prepare(self, lengths):
+        """
+        Compile every effect for every zone length, reading compiled programs from the disk
+        cache when available. This method blocks while compiling, which may be lengthy.
+
+        :param lengths: Zone lengths to compile for, as any iterable.
+        """
+        lengths = set(lengths)
+        for effect in self._effects.values():
+            for length in lengths:
+                self.program(effect, length)
+
+    def program(self, effect: Effect, length: int) -> FrameProgram:
+        """
+        Retrieve the compiled program of an effect for a zone length, compiling it if needed.
+
+        :param effect: The effect.
+        :param length: The number of pixels in the zone.
+        :return: The compiled frames.
+        """
+        key = (effect.digest, length)
+        program = self._programs.get(key)
+        if program is None:
+            program = self._read(key)
+            if program is None:
+                program = effect.compile(length)
+                self._write(key, program)
+            self._programs[key] = program
+        return program
+
+    def _path(self, key: tuple) -> str:
+        digest, length = key
+        return os.path.join(self.cache_dir, f"{digest[:32]}-{length}.npz")
+
+    def _read(self, key: tuple) -> FrameProgram:
+        if self.cache_dir is None or not os.path.exists(self._path(key)):
+            return None
+        try:
+            with np.load(self._path(key)) as cached:
+                return FrameProgram(cached['frames'], cached['holds'], int(cached['repeat']))
+        except Exception as e:
+            # such as a truncated file; compiled again and replaced
+            log.warning("Ignoring cached effect program %s: %s", self._path(key), e)
+            return None
+
+    def _write(self, key: tuple, program: FrameProgram):
+        if self.cache_dir is None:
+            return
+        # replaced atomically, so a power cut while writing leaves no partial file
+        path = self._path(key)
+        try:
+            os.makedirs(self.cache_dir, exist_ok = True)
+            with open(path + ".tmp", 'wb') as cache_file:
+                np.savez(cache_file, frames = program.frames, holds = program.holds, repeat = program.repeat)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            log.warning("Could not cache effect program %s: %s", self._path(key), e)
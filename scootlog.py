@@ -0,0 +1,213 @@
+import _queue
+import _thread
+import atexit
+import collections
+import logging
+import sys
+
+# gevent replaces threads with greenlets; the writer must run in a native thread so
+# that console writes never block the request greenlets
+try:
+    from gevent import monkey
+    _start_native_thread = monkey.get_original('_thread', 'start_new_thread')
+    _allocate_native_lock = monkey.get_original('_thread', 'allocate_lock')
+except ImportError:
+    _start_native_thread = _thread.start_new_thread
+    _allocate_native_lock = _thread.allocate_lock
+
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+# marks the end of the queue for the writer
+_STOP = object()
+
+
+class RepeatFilter(logging.Filter):
+    """
+    Caps the rate of repeated messages. Messages are repeats if they come from the same logger with
+    the same level and format string, whatever their arguments. Within each interval, the first
+    messages up to the burst are passed and the rest are dropped; the next message passed then
+    reports how many were dropped.
+    """
+
+    def __init__(self, burst: int = 5, interval_s: float = 10.0):
+        """
+        Initialize the filter.
+
+        :param burst: The number of repeats passed per interval.
+        :param interval_s: The length of the interval, in seconds.
+        """
+        super().__init__()
+        self.burst = burst
+        self.interval_s = interval_s
+        # (interval start, passed, dropped) by message key
+        self._repeats = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # the filter is shared by several handlers; count each record once
+        if hasattr(record, 'repeat_passed'):
+            return record.repeat_passed
+        record.repeat_passed = self._count(record)
+        return record.repeat_passed
+
+    def _count(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.levelno, record.msg)
+        start, passed, dropped = self._repeats.get(key, (record.created, 0, 0))
+        if record.created - start >= self.interval_s:
+            start, passed = record.created, 0
+        if passed >= self.burst:
+            self._repeats[key] = (start, passed, dropped + 1)
+            return False
+        if dropped:
+            record.suppressed = dropped
+        self._repeats[key] = (start, passed + 1, 0)
+        return True
+
+
+class RingBufferHandler(logging.Handler):
+    """
+    Keeps the most recent records in memory as structured events, for inspection at runtime.
+    """
+
+    def __init__(self, capacity: int = 500):
+        """
+        Initialize the handler.
+
+        :param capacity: The number of events kept.
+        """
+        super().__init__()
+        self._events = collections.deque(maxlen = capacity)
+
+    def emit(self, record: logging.LogRecord):
+        # records are converted to events when read, keeping logging calls cheap
+        self._events.append(record)
+
+    @staticmethod
+    def _event(record: logging.LogRecord) -> dict:
+        event = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'suppressed', 0):
+            event['suppressed'] = record.suppressed
+        if record.exc_info:
+            event['exception'] = logging.Formatter().formatException(record.exc_info)
+        return event
+
+    def events(self, count: int = None, level: int = logging.NOTSET) -> list:
+        """
+        Retrieve the most recent events, oldest first.
+
+        :param count: The maximum number of events. Defaults to all events kept.
+        :param level: The lowest level of the events.
+        :return: A list of events, each a dictionary with the time, level, logger and message.
+        """
+        records = [record for record in list(self._events) if record.levelno >= level]
+        return [self._event(record) for record in (records[-count:] if count else records)]
+
+
+class QueueWriterHandler(logging.Handler):
+    """
+    Queues records for a background writer in a native thread, which formats and writes them,
+    so that logging never waits on formatting or console I/O.
+    """
+
+    def __init__(self, stream = None):
+        """
+        Initialize the handler and start the writer.
+
+        :param stream: The stream to write to. Defaults to stderr.
+        """
+        super().__init__()
+        self._stream = stream if stream is not None else sys.stderr
+        self._queue = _queue.SimpleQueue()
+        # released by the writer once stopped
+        self._stopped = _allocate_native_lock()
+        self._stopped.acquire()
+        self._closed = False
+        _start_native_thread(self._write, ())
+
+    def emit(self, record: logging.LogRecord):
+        self._queue.put(record)
+
+    def _write_record(self, record: logging.LogRecord):
+        try:
+            line = self.format(record)
+            if getattr(record, 'suppressed', 0):
+                line += f" ({record.suppressed} repeats suppressed)"
+            self._stream.write(line + "\n")
+        except Exception:
+            self.handleError(record)
+
+    def _write(self):
+        """
+        Write queued records until stopped, flushing once the queue is drained.
+        """
+        while True:
+            record = self._queue.get()
+            while record is not _STOP:
+                self._write_record(record)
+                try:
+                    record = self._queue.get_nowait()
+                except _queue.Empty:
+                    break
+            self._stream.flush()
+            if record is _STOP:
+                self._stopped.release()
+                return
+
+    def close(self):
+        """
+        Write every queued record, then stop the writer. Closing again, as at exit after
+        logging.shutdown(), does nothing.
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(_STOP)
+            self._stopped.acquire(timeout = 5)
+        super().close()
+
+
+_ring = RingBufferHandler()
+
+
+def setup(level: str = "INFO", ring_capacity: int = 500, repeat_burst: int = 5, repeat_interval_s: float = 10.0):
+    """
+    Route all logging through the background writer and the ring buffer of recent events.
+    Call once at startup, after any monkey patching.
+
+    :param level: The name of the lowest level logged, i.e. 'INFO'.
+    :param ring_capacity: The number of recent events kept for recent().
+    :param repeat_burst: The number of repeats of a message logged per interval.
+    :param repeat_interval_s: The interval over which repeats are counted, in seconds.
+    """
+    global _ring
+    writer = QueueWriterHandler()
+    writer.setFormatter(logging.Formatter(LOG_FORMAT))
+    _ring = RingBufferHandler(ring_capacity)
+    repeats = RepeatFilter(repeat_burst, repeat_interval_s)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in (writer, _ring):
+        handler.addFilter(repeats)
+        root.addHandler(handler)
+    atexit.register(writer.close)
+
+
+def recent(count: int = None, level: str = "NOTSET") -> list:
+    """
+    Retrieve the most recent events logged, oldest first.
+
+    :param count: The maximum number of events. Defaults to all events kept.
+    :param level: The name of the lowest level of the events, i.e. 'WARNING'.
+    :return: A list of events, each a dictionary with the time, level, logger and message.
+             Raises ValueError if the level is unknown.
+    """
+    levelno = logging.getLevelName(level.upper())
+    if not isinstance(levelno, int):
+        raise ValueError(f"Unknown log level '{level}'")
+    return _ring.events(count, levelno)
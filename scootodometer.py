@@ -2,8 +2,10 @@ import time
 import threading
 from typing import Callable
 import atexit
+import asyncio
+import collections
+import logging
 
-import sys
 import os
 from configparser import ConfigParser
 
@@ -18,11 +20,17 @@ else:
 
 import math
 
+log = logging.getLogger(__name__)
+
+
 class ScootOdometer:
     """
     A class responsible for handling encoder signals for a scooter, managing speed detection
     and trajectory calculations.
 
+    Pulses are handled either by threads, or, when an asyncio event loop is given, by tasks on that loop:
+    GPIO edges are then bridged onto the loop through a thread-safe queue, and run_async() must be awaited.
+
     Attributes:
         _trajectory (Trajectory): An instance of Trajectory used to record the movement.
         _zero_speed_threshold_s (float): The threshold in seconds to determine if the scooter is at zero speed.
@@ -33,7 +41,9 @@ class ScootOdometer:
                  alpha: float = 0.75,
                  zero_speed_threshold_s: float = 0.75,
                  initial_position: float = 0.0,
-                 enabled: bool = raspi_detect.is_raspi):
+                 enabled: bool = raspi_detect.is_raspi,
+                 loop: asyncio.AbstractEventLoop = None,
+                 simulate_hz: float = 0.0):
         """
         Initialize the encoder with a pin, alpha value for trajectory smoothing, and zero speed threshold.
 
@@ -42,11 +52,20 @@ class ScootOdometer:
         :param zero_speed_threshold_s: The time threshold in seconds to consider the scooter to be at zero speed. Defaults to 0.75.
         :param initial_position: The initial position of the encoder, in pulses.
         :param enabled: Enable the hardware peripheral.
+        :param loop: Event loop on which to handle pulses. Defaults to handling pulses in threads.
+        :param simulate_hz: Rate of simulated pulses, for testing without the hardware. Defaults to none.
         """
         self._trajectory = Trajectory(alpha, initial_position)
+        self._trip_start = initial_position
         self._zero_speed_threshold_s = zero_speed_threshold_s
         self.enabled = enabled
-        self._encoder_check_speed_thread = threading.Thread(target = lambda: None)
+        self._loop = loop
+        self._simulate_hz = simulate_hz
+        self._running = False
+        self._threads = []
+        self._edges = asyncio.Queue() if loop is not None else None
+        # delay from each pulse to its trajectory step, in seconds
+        self._pulse_delays = collections.deque(maxlen = 1000)
 
         if not raspi_detect.is_raspi:
             self.enabled = False
@@ -56,17 +75,24 @@ class ScootOdometer:
             GPIO.setup(encoder_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
             GPIO.add_event_detect(encoder_pin, GPIO.RISING, callback = self.encoder_handler)
 
+        if self._loop is None and (self.enabled or self._simulate_hz > 0):
+            self._running = True
             # Start a daemon thread to check the speed periodically and adjust the trajectory.
-            self._encoder_check_speed_thread = threading.Thread(target = self.encoder_check_speed, daemon = True)
-            self._encoder_check_speed_thread.start()
+            self._threads.append(threading.Thread(target = self.encoder_check_speed, daemon = True))
+            if self._simulate_hz > 0:
+                self._threads.append(threading.Thread(target = self.encoder_simulate, daemon = True))
+            for thread in self._threads:
+                thread.start()
 
     def deinit(self):
         """
         De-initialize the encoder with a pin. Terminates speed check thread and cleans up GPIO pins.
         """
+        self._running = False  # signals encoder threads to stop
+        for thread in self._threads:
+            thread.join()
         if self.enabled:
-            self.enabled = False  # signals encoder thread to stop
-            self._encoder_check_speed_thread.join()
+            self.enabled = False
             GPIO.cleanup()
 
     def encoder_handler(self, channel: int):
@@ -75,19 +101,126 @@ class ScootOdometer:
 
         :param channel: The GPIO channel that triggered the event.
         """
-        self._trajectory.step(1.0)
+        timestamp = time.time()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._edges.put_nowait, timestamp)
+        else:
+            self._step(timestamp)
+
+    def _step(self, timestamp: float):
+        """
+        Step the trajectory for a pulse, and record the delay since the pulse.
+
+        :param timestamp: The time of the pulse.
+        """
+        self._trajectory.step(1.0, timestamp)
+        self._pulse_delays.append(time.time() - timestamp)
 
     def encoder_check_speed(self):
         """
         Execute periodically to determine if the speed is zero and add zero points to the trajectory.
         """
-        while self.enabled:
-            timestamp, _ = self._trajectory.speed()
-            # Check if the current time exceeds the threshold since the last pulse.
-            if time.time() - timestamp > self._zero_speed_threshold_s:
-                self._trajectory.not_moving()
+        while self._running:
+            self._check_speed()
             time.sleep(self._zero_speed_threshold_s / 2)
 
+    def _check_speed(self):
+        """
+        Add a zero point to the trajectory if the time since the last pulse exceeds the threshold.
+        """
+        timestamp, _ = self._trajectory.speed()
+        # Check if the current time exceeds the threshold since the last pulse.
+        if time.time() - timestamp > self._zero_speed_threshold_s:
+            self._trajectory.not_moving()
+
+    def encoder_simulate(self):
+        """
+        Execute continuously to produce simulated pulses at a fixed rate. The pulse time is the
+        scheduled time, so the recorded delay includes any lateness in scheduling.
+        """
+        start = time.time()
+        count = 0
+        while self._running:
+            count += 1
+            timestamp = start + count / self._simulate_hz
+            time.sleep(max(0.0, timestamp - time.time()))
+            self._step(timestamp)
+
+    async def run_async(self):
+        """
+        Handle pulses, check the speed and simulate pulses as tasks on the event loop. Runs until cancelled.
+        """
+        if not (self.enabled or self._simulate_hz > 0):
+            return
+        tasks = [self._handle_edges_async(), self._check_speed_async()]
+        if self._simulate_hz > 0:
+            tasks.append(self._simulate_async())
+        await asyncio.gather(*tasks)
+
+    async def _handle_edges_async(self):
+        while True:
+            self._step(await self._edges.get())
+
+    async def _check_speed_async(self):
+        while True:
+            self._check_speed()
+            await asyncio.sleep(self._zero_speed_threshold_s / 2)
+
+    async def _simulate_async(self):
+        start = time.time()
+        count = 0
+        while True:
+            count += 1
+            timestamp = start + count / self._simulate_hz
+            await asyncio.sleep(max(0.0, timestamp - time.time()))
+            self._edges.put_nowait(timestamp)
+
+    def trip(self) -> float:
+        """
+        Distance since the trip started. A trip starts with the service, and continues across warm restarts.
+
+        :return: The trip distance, in pulses.
+        """
+        _, position = self._trajectory.position()
+        return position - self._trip_start
+
+    def state(self) -> dict:
+        """
+        Report the state to restore after a restart.
+
+        :return: A dictionary with the trajectory state and the position at which the trip started.
+        """
+        return {'trajectory': self._trajectory.state(), 'trip_start': self._trip_start}
+
+    def restore(self, state: dict):
+        """
+        Resume the trajectory and trip running before a restart. Call before any pulses are handled.
+        The position is only restored if ahead of the current position, which may be more recent.
+
+        :param state: The state, as reported by state(). Raises KeyError, TypeError or ValueError
+                      if malformed, leaving the odometer unchanged.
+        """
+        trajectory = state['trajectory']
+        trip_start = float(state['trip_start'])
+        _, position = self._trajectory.position()
+        if float(trajectory['position']) >= position:
+            self._trajectory.restore(trajectory)
+        self._trip_start = trip_start
+
+    def stats(self) -> dict:
+        """
+        Report the trip distance, and the delay from each pulse to its trajectory step over the recent pulses.
+
+        :return: A dictionary with the trip distance, the number of pulses, and the 50th and 99th percentile and maximum delay.
+        """
+        delays = sorted(self._pulse_delays)
+        report = {'trip_pulses': round(self.trip(), 1), 'pulses': len(delays)}
+        if delays:
+            report['p50_ms'] = round(delays[len(delays) // 2] * 1000, 3)
+            report['p99_ms'] = round(delays[min(len(delays) - 1, len(delays) * 99 // 100)] * 1000, 3)
+            report['max_ms'] = round(delays[-1] * 1000, 3)
+        return report
+
     def register_callback(self, callback: Callable[[float, float, float], None]):
         """
         Register a callback to be called upon every trajectory step.
@@ -104,7 +237,7 @@ class ScootOdometerCache:
     It maintains 'distance_pulses' as a floating-point number and 'timestamp', updating them through a method.
     """
 
-    def __init__(self, filename: str = "odometer.ini", write_interval_s: int = 60):
+    def __init__(self, filename: str = "odometer.ini", write_interval_s: int = 60, timer: bool = True):
         """
         Initializes the ScootOdometerCache object with the provided filename and write interval.
 
@@ -112,14 +245,17 @@ class ScootOdometerCache:
                          Defaults to "odometer.ini".
         :param write_interval_s: The interval, in seconds, at which the most recent values are written to the file.
                                  Defaults to 60 seconds.
+        :param timer: Write using a timer thread. If False, run_async() must be awaited instead.
         """
         self.filename = filename
         self.config = ConfigParser()
         self.distance_pulses = 0.0 
         self.timestamp = 0.0 
         self.write_interval_s = write_interval_s
+        self.timer = None
         self._cache_read()
-        self._cache_write_timer_init()
+        if timer:
+            self._cache_write_timer_init()
         atexit.register(self.deinit)
 
     def _cache_read(self):
@@ -138,7 +274,7 @@ class ScootOdometerCache:
                 self.distance_pulses = float(self.config['DEFAULT'].get('distance_pulses', 0.0))
                 self.timestamp = float(self.config['DEFAULT'].get('timestamp', 0.0))
         except Exception as e:
-            sys.stderr.write(f"Error loading most recent values: {e}\n")
+            log.error("Error loading most recent values: %s", e)
 
     def _cache_write(self):
         """
@@ -150,7 +286,7 @@ class ScootOdometerCache:
             with open(self.filename, 'w') as configfile:
                 self.config.write(configfile)
         except Exception as e:
-            sys.stderr.write(f"Error writing most recent values: {e}\n")
+            log.error("Error writing most recent values: %s", e)
 
     def _cache_write_timer_init(self):
         """
@@ -160,6 +296,14 @@ class ScootOdometerCache:
         self.timer.daemon = True  # Make the timer thread a daemon thread
         self.timer.start()
 
+    async def run_async(self):
+        """
+        Periodically write the most recent values to the cache as a task on the event loop. Runs until cancelled.
+        """
+        while True:
+            await asyncio.sleep(self.write_interval_s)
+            self._cache_write()
+
     def set_distance(self, timestamp: float, distance: float, speed: float):
         """
         Sets the most recent value of 'distance_pulses' and updates the 'timestamp'. The 'speed' parameter is accepted
@@ -184,7 +328,8 @@ class ScootOdometerCache:
         """
         Stops the timer and writes the most recent values one last time before exiting.
         """
-        self.timer.cancel()
+        if self.timer is not None:
+            self.timer.cancel()
         self._cache_write()
 
 
@@ -207,13 +352,15 @@ class Trajectory:
         self._speed_filter = ExponentialSmoothing(alpha, 0.001)  # Exponential smoothing filter for speed
         self._step_callbacks = []
         
-    def step(self, step_pulses: float = 1.0):
+    def step(self, step_pulses: float = 1.0, timestamp: float = None):
         """
         Updates the position and speed based on the step pulses received since the last update.
 
         :param step_pulses: The number of pulses since the last update, which is proportional to the distance moved.
+        :param timestamp: The time of the pulse. Defaults to now.
         """
-        timestamp = time.time()
+        if timestamp is None:
+            timestamp = time.time()
         dt = timestamp - self._last_timestamp
         new_position = self._last_position + step_pulses
         new_speed = self._speed_filter.smooth(step_pulses / dt)
@@ -250,6 +397,32 @@ class Trajectory:
         """
         return self._last_timestamp, self._last_speed
 
+    def state(self) -> dict:
+        """
+        Report the state to restore after a restart, including the state of the speed filter.
+
+        :return: A dictionary with the last timestamp, position, speed and smoothed speed.
+        """
+        return {'timestamp': self._last_timestamp,
+                'position': self._last_position,
+                'speed': self._last_speed,
+                'filter': self._speed_filter.value()}
+
+    def restore(self, state: dict):
+        """
+        Resume from the state before a restart, so the first speed after the restart is
+        measured from the last pulse before it and smoothed as if there had been no restart.
+
+        :param state: The state, as reported by state(). Raises KeyError, TypeError or ValueError
+                      if malformed, leaving the trajectory unchanged.
+        """
+        timestamp, position, speed = float(state['timestamp']), float(state['position']), float(state['speed'])
+        smoothed = None if state['filter'] is None else float(state['filter'])
+        self._last_timestamp = timestamp
+        self._last_position = position
+        self._last_speed = speed
+        self._speed_filter.restore(smoothed)
+
     def register_callback(self, callback: Callable[[float, float, float], None]):
         """
         Register a callback to be issued upon every trajectory step.
@@ -296,4 +469,12 @@ class ExponentialSmoothing:
 
         :return: The last smoothed data value.
         """
-        return self._last_smoothed
\ No newline at end of file
+        return self._last_smoothed
+
+    def restore(self, value: float):
+        """
+        Resumes smoothing from a value returned by value(), such as before a restart.
+
+        :param value: The last smoothed data value, or None to start afresh.
+        """
+        self._last_smoothed = value
\ No newline at end of file
@@ -0,0 +1,110 @@
+import collections
+from typing import Callable
+
+import numpy as np
+
+import scootthreads
+
+
+class OutputStage:
+    """
+    Sits between the effects and the LED driver. Frames are handed to a native writer thread through a
+    single pending slot: a frame submitted while the strip is still busy replaces the pending frame
+    (coalesced), and a frame matching the last frame written is not sent over the wire (skipped).
+    Frames written, skipped and coalesced are counted for each effect drawn in them.
+    """
+
+    def __init__(self, write: Callable[[np.ndarray], None], shown: Callable[[], None] = None, tolerance: int = 0):
+        """
+        Initialize the stage, stopped.
+
+        :param write: Called in the writer thread to send a uint8 frame to the LEDs, blocking until written.
+        :param shown: Called in the writer thread once a frame is on the LEDs, whether written or skipped.
+        :param tolerance: Largest per-channel difference from the last frame written for which a frame is skipped.
+        """
+        self._write = write
+        self._shown = shown
+        self._tolerance = tolerance
+        self._last = None
+        self._pending = None
+        self._lock = scootthreads.allocate_lock()
+        self._ready = scootthreads.Signal()
+        self._running = False
+        self._thread = scootthreads.Thread(self._run, "output")
+        self._counts = collections.defaultdict(lambda: {'written': 0, 'skipped': 0, 'coalesced': 0})
+
+    def start(self):
+        """
+        Start writing in a native daemon thread, so that frames keep their timing under gevent.
+        """
+        self._running = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop writing. A pending frame is discarded.
+        """
+        self._running = False
+        self._ready.set()
+        self._thread.join()
+
+    def submit(self, frame: np.ndarray, effects: tuple):
+        """
+        Submit a frame for writing, replacing any frame not yet written. Does not block on the strip.
+
+        :param frame: uint8 array of shape (pixel count, 3).
+        :param effects: The names of the effects drawn in the frame, for reporting.
+        """
+        with self._lock:
+            if self._pending is not None:
+                self._count(self._pending[1], 'coalesced')
+            self._pending = (frame, effects)
+        self._ready.set()
+
+    def _count(self, effects: tuple, outcome: str):
+        """
+        Count the outcome of a frame for each effect drawn in it. Call with the lock held.
+        """
+        for effect in effects:
+            self._counts[effect][outcome] += 1
+
+    def stats(self) -> dict:
+        """
+        Report frames written, skipped as unchanged, and coalesced with a newer frame.
+
+        :return: Counts by effect name.
+        """
+        with self._lock:
+            return {effect: dict(counts) for effect, counts in self._counts.items()}
+
+    def _unchanged(self, frame: np.ndarray) -> bool:
+        """
+        Check if a frame matches the last frame written, within the tolerance.
+        """
+        if self._last is None:
+            return False
+        if self._tolerance == 0:
+            return np.array_equal(frame, self._last)
+        return int(np.abs(frame.astype(np.int16) - self._last).max()) <= self._tolerance
+
+    def _run(self):
+        """
+        Write pending frames until stopped.
+        """
+        while self._running:
+            self._ready.wait()
+            with self._lock:
+                pending, self._pending = self._pending, None
+            if pending is None or not self._running:
+                continue
+            frame, effects = pending
+            if self._unchanged(frame):
+                outcome = 'skipped'
+            else:
+                self._write(frame)
+                self._last = frame
+                outcome = 'written'
+            with self._lock:
+                self._count(effects, outcome)
+            if self._shown is not None:
+                self._shown()
@@ -1,202 +1,414 @@
 import raspi_detect
 
-if raspi_detect.is_raspi:
-    import neopixel
-
+import logging
 import time
-import random
+from typing import Callable
+
+import numpy as np
+
+import scootchannels
+import scootcompositor
+import scootoutput
+import scootpower
+
+# Minimum time a flash shows its color: one frame at the default frame rate
+FLASH_MIN_HOLD_S = 0.010
+
+log = logging.getLogger(__name__)
+
 
 class ScootPixels:
     """
     A class to manage the NeoPixel LED on a scooter, allowing for various lighting effects
     such as tricolor sequence, underlight cylon pattern, disco strobe, and solid color display.
 
+    Effects are rendered as layers by a compositor, so effects in different zones run concurrently
+    and are written to the strip as a single frame per tick. Unchanged frames are not written, and
+    frames produced faster than the strip accepts them are coalesced. The strip may be split across
+    several outputs, which are written concurrently.
+
     Attributes:
+        color: The solid color shown beneath the effects.
         _pin: GPIO identifier to which the NeoPixel LEDs are connected.
         _pixel_count: The total number of NeoPixel LEDs.
-        _pixels: Instance of NeoPixel class to control the LEDs.
+        _output: Instance of ChannelGroup writing frames to the LEDs.
+        _stage: Instance of OutputStage skipping and coalescing frames ahead of the LEDs.
+        _compositor: Instance of Compositor blending the effect layers.
     """
 
-    def __init__(self, pin, pixel_count: int, enabled: bool = raspi_detect.is_raspi):
+    def __init__(self,
+                 pin,
+                 pixel_count: int,
+                 enabled: bool = raspi_detect.is_raspi,
+                 zones: dict = None,
+                 fps: float = 100.0,
+                 channels: list = None,
+                 simulated: bool = False,
+                 current_budget_ma: float = None):
         """
         Initialize the ScootPixels with the specified pin and pixel count.
 
         :param pin: The GPIO pin where the NeoPixel LEDs are connected, i.e. 18 = GPIO 18 (pin 12).
         :param pixel_count: The number of NeoPixel LEDs.
         :param enabled: Enable hardware output.
+        :param zones: Named pixel index ranges, as {name: (start, stop)}. The zone 'all' is always defined.
+        :param fps: The maximum number of frames written to the LEDs per second.
+        :param channels: Segments of the strip on separate outputs, as a list of (pin, start, stop).
+                         Defaults to the whole strip on pin.
+        :param simulated: Write to simulated outputs modeling the wire time, rather than to hardware.
+        :param current_budget_ma: Current budget for the LEDs in mA; frames are dimmed to stay within it.
+                                  Defaults to no limit.
         """
         self._pin = pin
         self._pixel_count = pixel_count
         self.enabled = enabled
+        self.color = (0, 0, 0)
+        self._stage = scootoutput.OutputStage(self._show, self._frame_shown)
+        self._compositor = scootcompositor.Compositor(pixel_count, self._stage.submit, zones, fps)
+        self._frame_callbacks = []
+        self._segments = channels or [(pin, 0, pixel_count)]
+        self._limiter = None
+        if current_budget_ma is not None:
+            self._limiter = scootpower.PowerLimiter(pixel_count, current_budget_ma)
+
+        covered = sorted((start, stop) for _, start, stop in self._segments)
+        if covered[0][0] != 0 or covered[-1][1] != pixel_count or \
+                any(stop != start for (_, stop), (start, _) in zip(covered, covered[1:])):
+            raise ValueError("Channel segments must cover the strip without gaps or overlap")
 
-        if not raspi_detect.is_raspi:
+        if not raspi_detect.is_raspi and not simulated:
             self.enabled = False
         if self.enabled:
-            self._pixels = neopixel.NeoPixel(
-                pin = self._pin,
-                n = self._pixel_count,
-                auto_write = False
-            )
+            if simulated:
+                self._output = scootchannels.ChannelGroup(scootchannels.simulated_channels(self._segments))
+            else:
+                self._output = scootchannels.ChannelGroup(scootchannels.hardware_channels(self._segments))
+            log.info("Writing %d pixels to %d %s channels", pixel_count, len(self._segments),
+                     "simulated" if simulated else "hardware")
+            self._stage.start()
+            self._compositor.start()
             self.off()
 
+    @property
+    def zones(self) -> dict:
+        """
+        Zones by name.
+        """
+        return self._compositor.zones
+
     def deinit(self):
         """
         Deinitialize the pixels and release the resources.
         """
         if not self.enabled:
             return
-        self.off()
-        self._pixels.deinit()
+        self._compositor.stop()
+        self._stage.stop()
+        self._show(np.zeros((self._pixel_count, 3), dtype = np.uint8))
+        self._output.deinit()
 
-    def tricolor(self):
+    def _show(self, frame: np.ndarray):
         """
-        Display a tricolor sequence on the LEDs, cycling through red, green, and blue.
+        Write a frame to the LEDs.
+
+        :param frame: uint8 array of shape (pixel_count, 3).
+        """
+        if self._limiter is not None:
+            frame = self._limiter.limit(frame)
+        self._output.write(frame)
+
+    def _frame_shown(self):
+        """
+        Issue callbacks once a frame is on the LEDs, whether written or unchanged.
+        """
+        timestamp = time.time()
+        for callback in self._frame_callbacks:
+            callback(timestamp)
+
+    def stats(self) -> dict:
+        """
+        Report output statistics.
+
+        :return: A dictionary with the statistics of each output channel by channel name,
+                 the frames written, skipped and coalesced by effect name,
+                 and the estimated current draw if limited.
+        """
+        if not self.enabled:
+            return {}
+        stats = {'channels': self._output.stats(), 'effects': self._stage.stats()}
+        if self._limiter is not None:
+            stats['power'] = self._limiter.stats()
+        return stats
+
+    def state(self) -> dict:
+        """
+        Report the state to restore after a restart: the solid color, and the effects playing
+        with the time elapsed since each started. Live effects are not included.
+
+        :return: A dictionary with the color, and the effects as a list of dictionaries with the name,
+                 zone and elapsed time of each.
+        """
+        now = time.monotonic()
+        effects = [{'name': layer.name, 'zone': layer.zone.name, 'elapsed_s': round(now - layer.started, 3)}
+                   for layer in self._compositor.layers()
+                   if not isinstance(layer, scootcompositor.LiveLayer) and layer.started is not None
+                   and not layer.finished.is_set()]
+        return {'color': list(self.color), 'effects': effects}
+
+    def register_callback(self, callback: Callable[[float], None]):
+        """
+        Register a callback to be issued after every frame shown on the LEDs, including frames
+        not written because they were unchanged.
+
+        :param callback: method with signature (timestamp: float) -> None, called with the time the frame was shown.
+        """
+        self._frame_callbacks.append(callback)
+
+    def refresh(self):
+        """
+        Composite and write the next frame immediately rather than at the next tick.
+        Use to reduce the latency of live effects.
+        """
+        if not self.enabled:
+            return
+        self._compositor.wake()
+
+    def play(self, name: str, frames, zone: str = "all", blend: str = scootcompositor.BLEND_ALPHA,
+             priority: int = 0, wait: bool = True) -> scootcompositor.Layer:
+        """
+        Play an effect as a layer in a zone, replacing any running effect with the same name.
+
+        :param name: The name of the effect layer.
+        :param frames: Iterator yielding (frame, hold_s) tuples sized to the zone.
+        :param zone: The name of the zone to play in.
+        :param blend: The blend mode of the layer.
+        :param priority: Layers are blended in order of increasing priority.
+        :param wait: Block until the effect has finished.
+        :return: The layer, or None if disabled.
+        """
+        if not self.enabled:
+            return None
+        layer = self._compositor.add_layer(scootcompositor.Layer(
+            name, self.zones[zone], frames, blend, priority = priority))
+        if wait:
+            layer.finished.wait()
+        return layer
+
+    def play_live(self, name: str, render: Callable[[float], np.ndarray], zone: str = "all",
+                  blend: str = scootcompositor.BLEND_ALPHA, priority: int = 0) -> scootcompositor.LiveLayer:
+        """
+        Play a live effect as a layer in a zone, replacing any running effect with the same name.
+        The effect runs until stopped.
+
+        :param name: The name of the effect layer.
+        :param render: Called with the current monotonic time, returns a frame sized to the zone.
+        :param zone: The name of the zone to play in.
+        :param blend: The blend mode of the layer.
+        :param priority: Layers are blended in order of increasing priority.
+        :return: The layer, or None if disabled.
+        """
+        if not self.enabled:
+            return None
+        return self._compositor.add_layer(scootcompositor.LiveLayer(
+            name, self.zones[zone], render, blend, priority = priority))
+
+    def stop(self, name: str):
+        """
+        Stop an effect layer, if running.
+
+        :param name: The name of the effect layer.
         """
         if not self.enabled:
             return
+        self._compositor.remove_layer(name)
+
+    def tricolor(self, wait: bool = True) -> scootcompositor.Layer:
+        """
+        Display a tricolor sequence on the LEDs, cycling through red, green, and blue.
+
+        :param wait: Block until the effect has finished.
+        :return: The effect layer, or None if disabled.
+        """
+        if not self.enabled:
+            return None
         sequence = [(255, 0, 0), (0, 255, 0), (0, 0, 255)]
-        for color in sequence:
-            self.solid(color)
-            time.sleep(0.250)
-        self.off()  # Turn off the lights after the sequence
+        self.off()  # Beneath the sequence, so the lights are off after it
+        return self.play("tricolor", (
+            (np.tile(np.array(color, dtype = np.uint8), (self._pixel_count, 1)), 0.250)
+            for color in sequence), wait = wait)
 
-    def fireplace(self, duration_s = 5.0):
+    def fireplace(self, duration_s = 5.0, zone: str = "all", wait: bool = True) -> scootcompositor.Layer:
         """
         Show a fireplace.
 
         :param duration: The duration of the fireplace effect.
+        :param zone: The name of the zone to play in.
+        :param wait: Block until the effect has finished.
+        :return: The effect layer, or None if disabled.
         """
         if not self.enabled:
-            return
+            return None
+        return self.play("fireplace", self._fireplace_frames(len(self.zones[zone]), duration_s), zone, wait = wait)
 
+    @staticmethod
+    def _fireplace_frames(length: int, duration_s: float):
+        """
+        Frames of the fireplace effect: a random walk of each pixel within the range of fire colors.
+
+        :param length: The number of pixels.
+        :param duration_s: The duration of the effect.
+        """
         # alpha, brightnesss
         brightness = 0.25
-        start_time = time.time()
-        last_color = [(0.0, 0.0, 0.0)] * self._pixel_count
-        while time.time() - start_time < duration_s:
-            for pixel in range(self._pixel_count):
-                last_r, last_g, last_b = last_color[pixel]
-                # randomly choose colors within the range of fire colors
-                r = int(min(255, max(0, last_r + random.randint(-255, 255))) * brightness)
-                g = int(min(96, max(0, last_g + random.randint(-6, 6))) * brightness)
-                b = int(min(48, max(0, last_b + random.randint(-4, 4))) * brightness)
-                self._pixels[pixel] = tuple([r, g, b])
-                last_color[pixel] = (r, g, b)
-            self._pixels.show()
-            time.sleep(0.125)
-
-    def underlight(self, count: int = 1):
+        rng = np.random.default_rng()
+        last_color = np.zeros((length, 3), dtype = np.int32)
+        step_low = np.array([-255, -6, -4])
+        step_high = np.array([256, 7, 5])
+        color_max = np.array([255, 96, 48])
+        period_s = 0.125
+        for _ in range(int(duration_s / period_s)):
+            # randomly choose colors within the range of fire colors
+            color = last_color + rng.integers(step_low, step_high, size = (length, 3))
+            last_color = (np.clip(color, 0, color_max) * brightness).astype(np.int32)
+            yield last_color.astype(np.uint8), period_s
+
+    def underlight(self, count: int = 1, zone: str = "all", wait: bool = True) -> scootcompositor.Layer:
         """
         Display a 'cylon' pattern underneath the scooter, moving back and forth.
 
         :param count: The number of times to repeat the cylon pattern.
+        :param zone: The name of the zone to play in.
+        :param wait: Block until the effect has finished.
+        :return: The effect layer, or None if disabled.
         """
         if not self.enabled:
-            return
-        # Rotate the cylon pattern for the specified count
+            return None
+        return self.play("underlight", self._underlight_frames(len(self.zones[zone]), count), zone, wait = wait)
+
+    @staticmethod
+    def _underlight_frames(length: int, count: int):
+        """
+        Frames of the underlight effect: a triangular ramp rotated once around the strip per color.
+
+        :param length: The number of pixels.
+        :param count: The number of times to repeat the cylon pattern.
+        """
+        half = length / 2
+        ramp = ((1 - np.abs(half - np.arange(length)) / half) * 255).astype(np.uint8)
         for n in range(count):
             for color in [(1, 0, 0), (0, 1, 0), (0, 0, 1)]:
-                # Initialize pattern
-                for pixel in range(self._pixel_count):
-                    value = int((1 - abs((self._pixel_count / 2) - pixel) / (self._pixel_count / 2)) * 255)
-                    self._pixels[pixel] = tuple(value * k for k in color)
-
+                pattern = np.outer(ramp, np.array(color, dtype = np.uint8))
                 # Cycle the pattern through the pixels
-                for cycle in range(self._pixel_count):
-                    last_pixel = self._pixels[0]
-                    for pixel in range(self._pixel_count - 1):
-                        self._pixels[pixel] = self._pixels[pixel + 1]
-                    self._pixels[self._pixel_count - 1] = last_pixel
-                    self._pixels.show()
-                    time.sleep(0.005)
+                for cycle in range(length):
+                    hold_s = 0.005
+                    if cycle + 1 == length:
+                        hold_s += 0.050  # Give the CPU a break between colors
+                    yield np.roll(pattern, -(cycle + 1), axis = 0), hold_s
 
-                time.sleep(0.050)  # Give the CPU a break between colors
-
-        self.off()  # Turn off the lights after the pattern
-
-    def energyweapon(self):
+    def energyweapon(self, zone: str = "all", wait: bool = True) -> scootcompositor.Layer:
         """
         Display an energy weapon pattern, with a chargeup and blast.
+
+        :param zone: The name of the zone to play in.
+        :param wait: Block until the effect has finished.
+        :return: The effect layer, or None if disabled.
         """
         if not self.enabled:
-            return
-        
-        self.off()
-        
+            return None
+        return self.play("energyweapon", self._energyweapon_frames(len(self.zones[zone])), zone, wait = wait)
+
+    @staticmethod
+    def _energyweapon_frames(length: int):
+        """
+        Frames of the energy weapon effect.
+
+        :param length: The number of pixels.
+        """
+        frame = np.zeros((length, 3), dtype = np.uint8)
+
         # Fill green one LED at a time
-        for pixel in range(self._pixel_count):
-            self._pixels[pixel] = (0, 255, 0)
-            self._pixels.show()
-            time.sleep(2.5 / self._pixel_count)  # two second duration
+        for pixel in range(length):
+            frame[pixel] = (0, 255, 0)
+            yield frame.copy(), 2.5 / length  # two second duration
 
         # Fade to white
         num_steps = 10
         for step in range(num_steps):
-            color = (step * 255 // num_steps, 255, step * 255 // num_steps)
-            for pixel in range(self._pixel_count):
-                self._pixels[pixel] = color
-            self._pixels.show()
-            time.sleep(0.75 / num_steps)
+            frame[:] = (step * 255 // num_steps, 255, step * 255 // num_steps)
+            yield frame.copy(), 0.75 / num_steps
 
         # Change to red, two at a time
-        for pixel in range(0, self._pixel_count, 2):
-            self._pixels[pixel] = (255, 0, 0)  # Red color
-            if pixel + 1 < self._pixel_count:
-                self._pixels[pixel + 1] = (255, 0, 0)
-            self._pixels.show()
+        for pixel in range(0, length, 2):
+            frame[pixel:pixel + 2] = (255, 0, 0)  # Red color
+            yield frame.copy(), 0.005
 
         # Fade to black
         num_steps = 100
         for step in range(num_steps, -1, -1):
-            color = (step * 255 // num_steps, 0, 0)
-            for pixel in range(self._pixel_count):
-                self._pixels[pixel] = color
-            self._pixels.show()
-            time.sleep(2.0 / num_steps)
-                
-        self.off()  # Turn off the lights after the pattern
+            frame[:] = (step * 255 // num_steps, 0, 0)
+            yield frame.copy(), 2.0 / num_steps
 
-    def disco(self, count: int = 10, delay_s: float = 0.1):
+    def disco(self, count: int = 10, delay_s: float = 0.1, zone: str = "all", wait: bool = True) -> scootcompositor.Layer:
         """
         Display a colorful strobe pattern resembling a disco light.
 
         :param count: The number of strobe flashes.
         :param delay_s: The time delay in seconds between each flash.
+        :param zone: The name of the zone to play in.
+        :param wait: Block until the effect has finished.
+        :return: The effect layer, or None if disabled.
         """
         if not self.enabled:
-            return
-        for n in range(count):
-            for color in [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 255)]:
-                self.flash(color)
-                if delay_s > 0:
-                    time.sleep(delay_s)
+            return None
+        length = len(self.zones[zone])
+        colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 255)]
+        return self.play("disco", (
+            frame
+            for n in range(count)
+            for color in colors
+            for frame in self._flash_frames(length, color, 1, delay_s)), zone, wait = wait)
 
-    def flash(self, color: tuple = (255, 255, 255), count: int = 1):
+    def flash(self, color: tuple = (255, 255, 255), count: int = 1, wait: bool = True) -> scootcompositor.Layer:
         """
         Display a color that flashes on and then off.
 
         :param color: The color to flash.
         :param count: The number of times to flash the color.
+        :param wait: Block until the effect has finished.
+        :return: The effect layer, or None if disabled.
         """
         if not self.enabled:
-            return
+            return None
+        self.solid(color)  # Leave the color on after the last flash
+        return self.play("flash", self._flash_frames(self._pixel_count, color, count, 0.0), wait = wait)
+
+    @staticmethod
+    def _flash_frames(length: int, color: tuple, count: int, hold_s: float):
+        """
+        Frames of a flash: off, then on.
+
+        :param length: The number of pixels.
+        :param color: The color to flash.
+        :param count: The number of times to flash the color.
+        :param hold_s: Time to hold the color after the last flash, at least FLASH_MIN_HOLD_S
+                       so that the color is shown.
+        """
+        on = np.tile(np.array(color, dtype = np.uint8), (length, 1))
+        off = np.zeros((length, 3), dtype = np.uint8)
         for n in range(count):
-            self.off()  # Turn off before flashing
-            time.sleep(0.150)
-            self.solid(color)
-            if n + 1 < count:  # Sleep if not the last flash
-                time.sleep(0.150)
+            yield off, 0.150  # Turn off before flashing
+            yield on, 0.150 if n + 1 < count else max(hold_s, FLASH_MIN_HOLD_S)
 
     def solid(self, color: tuple = (0, 0, 0)):
         """
-        Display a solid color across all LEDs.
+        Display a solid color across all LEDs, beneath any running effects.
 
         :param color: The color to display.
         """
         if not self.enabled:
             return
-        self._pixels.fill(color)
-        self._pixels.show()
+        self.color = tuple(color)
+        self._compositor.background(color)
 
     def off(self):
         """
@@ -204,4 +416,4 @@ class ScootPixels:
         """
         if not self.enabled:
             return
-        self.solid((0, 0, 0))
\ No newline at end of file
+        self.solid((0, 0, 0))
@@ -0,0 +1,112 @@
+import time
+
+import numpy as np
+
+
+class PowerLimiter:
+    """
+    Estimates the current drawn by each frame and scales frames down to stay within a current budget,
+    protecting the battery-powered supply from brownouts during full-white effects.
+
+    Current is modeled per color channel as proportional to the channel value, plus a constant
+    quiescent current per pixel. Scaling uses a precomputed table of brightness levels, so limiting
+    a frame is a single table lookup.
+
+    Attributes:
+        budget_ma (float): The current budget for the LEDs, in mA.
+    """
+
+    def __init__(self,
+                 pixel_count: int,
+                 budget_ma: float,
+                 channel_ma: tuple = (20.0, 20.0, 20.0),
+                 idle_ma: float = 1.0,
+                 gamma: float = 1.0,
+                 levels: int = 256):
+        """
+        Initialize the limiter and precompute the brightness table.
+
+        :param pixel_count: The number of pixels on the strip.
+        :param budget_ma: The current budget for the LEDs, in mA. Must exceed the quiescent current of the strip.
+        :param channel_ma: Current drawn by one pixel with each of red, green and blue at full value, in mA.
+        :param idle_ma: Quiescent current drawn by one pixel when off, in mA.
+        :param gamma: Gamma correction applied to every frame. Defaults to none.
+        :param levels: The number of brightness levels in the table.
+        """
+        if budget_ma <= idle_ma * pixel_count:
+            raise ValueError(f"Current budget of {budget_ma} mA does not exceed the quiescent current "
+                             f"of {idle_ma * pixel_count} mA drawn by {pixel_count} pixels")
+        self.budget_ma = budget_ma
+        self._channel_ma = np.array(channel_ma, dtype = np.float64) / 255.0
+        self._idle_ma = idle_ma * pixel_count
+        self._levels = levels
+        # table of output values, indexed by brightness level then by input value
+        values = (np.arange(256) / 255.0) ** gamma
+        scale = np.arange(levels) / (levels - 1)
+        self._table = np.round(np.outer(scale, values) * 255).astype(np.uint8)
+        self._full = self._table[-1]
+        self._frames = 0
+        self._limited_frames = 0
+        self._limited_s = 0.0
+        self._last_ma = idle_ma * pixel_count
+        self._peak_ma = idle_ma * pixel_count
+        self._last_limited = None
+        self._process_s = 0.0
+
+    def estimate(self, frame: np.ndarray) -> float:
+        """
+        Estimate the current drawn while showing a frame.
+
+        :param frame: uint8 array of shape (pixel count, 3).
+        :return: The estimated current, in mA.
+        """
+        return self._idle_ma + float(frame.sum(axis = 0, dtype = np.uint32) @ self._channel_ma)
+
+    def limit(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Apply gamma correction and scale the frame down if it would exceed the current budget.
+
+        :param frame: uint8 array of shape (pixel count, 3).
+        :return: The frame to write, within the current budget.
+        """
+        start = time.monotonic()
+        source = frame
+        frame = self._full[source]
+        draw_ma = self.estimate(frame)
+        self._peak_ma = max(self._peak_ma, draw_ma)
+
+        limited = draw_ma > self.budget_ma
+        if limited:
+            # the variable part of the draw scales with brightness
+            level = int((self.budget_ma - self._idle_ma) / (draw_ma - self._idle_ma) * (self._levels - 1))
+            frame = self._table[max(0, level)][source]
+            draw_ma = self.estimate(frame)
+
+        # time spent limited: frames are shown until the next frame replaces them
+        if self._last_limited is not None:
+            self._limited_s += start - self._last_limited
+        self._last_limited = start if limited else None
+
+        self._frames += 1
+        self._limited_frames += limited
+        self._last_ma = draw_ma
+        self._process_s += time.monotonic() - start
+        return frame
+
+    def stats(self) -> dict:
+        """
+        Report estimated current draw and limiting.
+
+        :return: A dictionary with the budget, the estimated draw of the last frame as written,
+                 the peak estimated draw before limiting, the number of frames written and limited,
+                 the time spent limited, and the mean processing time per frame.
+        """
+        return {
+            'budget_ma': self.budget_ma,
+            'last_ma': round(self._last_ma, 1),
+            'peak_ma': round(self._peak_ma, 1),
+            'frames': self._frames,
+            'limited_frames': self._limited_frames,
+            'limited_s': round(self._limited_s, 3),
+            'process_us': round(self._process_s / self._frames * 1e6, 1) if self._frames else 0.0,
+        }
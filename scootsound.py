@@ -1,4 +1,10 @@
 import threading
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
 
 # audio libraries
 # be sure to import threading libraries prior to these imports
@@ -6,6 +12,13 @@ import threading
 from pydub import AudioSegment
 from pydub.playback import play
 
+log = logging.getLogger(__name__)
+
+# Directory from which sounds are loaded
+SOUNDS_DIR = "static/sounds/"
+# Index of the decoded sounds, kept in the cache directory
+INDEX_FILENAME = "index.json"
+
 class ScootSound:
     """
     Class to manage and play different audio effects for the scooter.
@@ -20,18 +33,28 @@ class ScootSound:
     Depencencies:
         threading
         pydub
+        ffplay (for play_async)
 
     :param enabled: bool: Enable audio output.
+    :param cache_dir: str: Directory in which decoded sounds are kept across restarts, so that they are decoded
+                           only once. A sound is decoded again only if its source file has changed.
     """
-    def __init__(self, enabled: bool = True):
+    def __init__(self, enabled: bool = True, cache_dir: str = None):
         """
         Initializes the ScootSound class with empty audio segments.
         """
         self.enabled = enabled
+        self.cache_dir = cache_dir
+        self._wav_cache = {}
+        self._sounds = {}
+        # decoded sounds in the cache directory by file name, as {'size', 'mtime', 'sha256'} of the
+        # source file and the name of the decoded 'wav'
+        self._index = self._read_index()
         self.sound_meltdown = AudioSegment.empty()
         self.sound_disco = AudioSegment.empty()
         self.sound_underlight = AudioSegment.empty()
         self.sound_fireplace = AudioSegment.empty()
+        self.sound_energyweapon = AudioSegment.empty()
         self.sound_lights_out = AudioSegment.empty()
 
     def import_from_disk(self):
@@ -41,12 +64,100 @@ class ScootSound:
         This method blocks while reading and parsing audio, which may be lengthy.
         """
         if self.enabled:
-            self.sound_meltdown = AudioSegment.from_mp3("static/sounds/meltdown.mp3")
-            self.sound_disco = AudioSegment.from_mp3("static/sounds/disco.mp3")
-            self.sound_underlight = AudioSegment.from_mp3("static/sounds/underlight.mp3")
-            self.sound_fireplace = AudioSegment.from_mp3("static/sounds/fireplace.mp3")
-            self.sound_energyweapon = AudioSegment.from_mp3("static/sounds/energyweapon.mp3")
-            self.sound_lights_out = AudioSegment.from_mp3("static/sounds/lights-out.mp3")
+            self.sound_meltdown = self.load("meltdown.mp3")
+            self.sound_disco = self.load("disco.mp3")
+            self.sound_underlight = self.load("underlight.mp3")
+            self.sound_fireplace = self.load("fireplace.mp3")
+            self.sound_energyweapon = self.load("energyweapon.mp3")
+            self.sound_lights_out = self.load("lights-out.mp3")
+
+    def load(self, filename: str) -> AudioSegment:
+        """
+        Imports an audio file from the 'static/sounds/' directory, once. Later calls return the same segment.
+        This method blocks while reading and parsing audio, which may be lengthy.
+
+        :param filename: Name of the audio file, relative to the 'static/sounds/' directory.
+        :return AudioSegment: The audio segment, or an empty segment if audio is disabled or the file cannot be read.
+        """
+        if filename not in self._sounds:
+            segment = AudioSegment.empty()
+            if self.enabled:
+                try:
+                    segment = self._decode(filename)
+                except Exception as e:
+                    log.error("Error loading sound %s: %s", filename, e)
+            self._sounds[filename] = segment
+        return self._sounds[filename]
+
+    def _decode(self, filename: str) -> AudioSegment:
+        """
+        Decodes an audio file, reading the decoded WAV from the cache directory if the file is unchanged.
+        A file is unchanged if its size and modification time match, or else if its content hash matches,
+        such as after the file was copied into a new container image.
+        """
+        path = SOUNDS_DIR + filename
+        source = os.stat(path)
+        entry = self._index.get(filename)
+        if entry is not None and entry['size'] == source.st_size:
+            unchanged = entry['mtime'] == source.st_mtime
+            if not unchanged and entry['sha256'] == self._hash(path):
+                entry['mtime'] = source.st_mtime
+                self._write_index()
+                unchanged = True
+            if unchanged:
+                try:
+                    return AudioSegment.from_wav(os.path.join(self.cache_dir, entry['wav']))
+                except Exception as e:
+                    log.warning("Ignoring cached sound %s: %s", entry['wav'], e)
+        segment = AudioSegment.from_file(path)
+        if self.cache_dir is not None:
+            wav = filename.replace("/", "_") + ".wav"
+            try:
+                os.makedirs(self.cache_dir, exist_ok = True)
+                # replaced atomically, so a power cut while writing leaves no partial file
+                temporary = os.path.join(self.cache_dir, wav + ".tmp")
+                segment.export(temporary, format = "wav").close()
+                os.replace(temporary, os.path.join(self.cache_dir, wav))
+                self._index[filename] = {'size': source.st_size, 'mtime': source.st_mtime,
+                                         'sha256': self._hash(path), 'wav': wav}
+                self._write_index()
+            except OSError as e:
+                log.warning("Could not cache decoded sound %s: %s", filename, e)
+        return segment
+
+    @staticmethod
+    def _hash(path: str) -> str:
+        with open(path, 'rb') as source_file:
+            return hashlib.sha256(source_file.read()).hexdigest()
+
+    def _read_index(self) -> dict:
+        """
+        Reads the index of decoded sounds from the cache directory.
+
+        :return dict: Cache entries by file name, or empty if there is no index.
+        """
+        if self.cache_dir is None:
+            return {}
+        try:
+            with open(os.path.join(self.cache_dir, INDEX_FILENAME)) as index_file:
+                return json.load(index_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring index of decoded sounds: %s", e)
+            return {}
+
+    def _write_index(self):
+        """
+        Writes the index of decoded sounds to the cache directory, replacing it atomically.
+        """
+        path = os.path.join(self.cache_dir, INDEX_FILENAME)
+        try:
+            with open(path + ".tmp", 'w') as index_file:
+                json.dump(self._index, index_file, indent = 1, sort_keys = True)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            log.warning("Could not write index of decoded sounds: %s", e)
 
     def play(self, segment: AudioSegment) -> threading.Thread:
         """
@@ -61,4 +172,24 @@ class ScootSound:
         else:
             thread = threading.Thread(target = lambda: None)
         thread.start()
-        return thread
\ No newline at end of file
+        return thread
+
+    async def play_async(self, segment: AudioSegment):
+        """
+        Plays an audio segment in an ffplay subprocess, waiting on the running event loop until it completes.
+        The segment is encoded to WAV once and cached.
+
+        :param segment (AudioSegment): The audio segment to be played.
+        """
+        if not self.enabled:
+            return
+        cached_segment, wav = self._wav_cache.get(id(segment), (None, None))
+        if cached_segment is not segment:
+            buffer = io.BytesIO()
+            segment.export(buffer, format = "wav")
+            wav = buffer.getvalue()
+            self._wav_cache[id(segment)] = (segment, wav)
+        process = await asyncio.create_subprocess_exec(
+            "ffplay", "-nodisp", "-autoexit", "-hide_banner", "-loglevel", "quiet", "pipe:0",
+            stdin = asyncio.subprocess.PIPE)
+        await process.communicate(wav)
\ No newline at end of file
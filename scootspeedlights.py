@@ -0,0 +1,214 @@
+import collections
+import logging
+
+import numpy as np
+
+import scootpixels
+
+# Live effect modes
+MODE_BAR = "bar"      # speedometer bar, filling the zone in proportion to the speed
+MODE_CHASE = "chase"  # chase pattern, advancing with the wheel
+MODES = (MODE_BAR, MODE_CHASE)
+
+# Name of the live effect layer
+LAYER_NAME = "speedlights"
+
+log = logging.getLogger(__name__)
+
+
+class ScootSpeedLights:
+    """
+    Drives a live pixel effect from the odometer trajectory, and measures the pulse-to-photon latency:
+    the time from an encoder pulse to the return of the strip update showing it.
+
+    Trajectory samples are stored as the latest value only and the compositor is woken immediately,
+    so a sample is shown on the next frame regardless of the frame rate or web traffic.
+
+    Attributes:
+        latency_budget_s (float): Pulse-to-photon latency budget, in seconds.
+        mode (str): The running mode, one of MODES, or None if stopped.
+        zone (str): The zone of the running mode, or None if stopped.
+    """
+
+    def __init__(self,
+                 pixels: scootpixels.ScootPixels,
+                 pulses_per_foot: float,
+                 max_speed_ft_s: float = 10.0,
+                 latency_budget_s: float = 0.025,
+                 latency_history: int = 1000):
+        """
+        Initialize the speed lights, stopped.
+
+        :param pixels: The pixels to play the live effect on.
+        :param pulses_per_foot: Encoder pulses per linear foot.
+        :param max_speed_ft_s: Speed at which the speedometer bar is full, in feet per second.
+        :param latency_budget_s: Pulse-to-photon latency budget, in seconds.
+        :param latency_history: Number of latency samples kept for reporting.
+        """
+        self.latency_budget_s = latency_budget_s
+        self.mode = None
+        self.zone = None
+        self._pixels = pixels
+        self._pulses_per_foot = pulses_per_foot
+        self._max_speed_ft_s = max_speed_ft_s
+        # latest trajectory sample as (timestamp, position, speed), replaced atomically;
+        # no timestamp until the first update(), so that only real samples are measured
+        self._sample = (None, 0.0, 0.0)
+        self._rendered_timestamp = None
+        self._shown_timestamp = None
+        self._latencies = collections.deque(maxlen = latency_history)
+        self._over_budget = 0
+        pixels.register_callback(self._frame_shown)
+
+    def start(self, mode: str = MODE_BAR, zone: str = "all"):
+        """
+        Start the live effect, replacing the running one if any.
+
+        :param mode: One of MODES.
+        :param zone: The name of the zone to play in.
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown speed lights mode '{mode}'")
+        length = len(self._pixels.zones[zone])
+        if mode == MODE_BAR:
+            render = self._bar_renderer(length)
+        else:
+            render = self._chase_renderer(length)
+        self.mode = mode
+        self.zone = zone
+        # only measure samples received from now on, not one which arrived while stopped
+        self._rendered_timestamp = None
+        self._shown_timestamp = self._sample[0]
+        # drawn above all other effects
+        self._pixels.play_live(LAYER_NAME, render, zone, priority = 100)
+
+    def stop(self):
+        """
+        Stop the live effect.
+        """
+        self.mode = None
+        self.zone = None
+        self._pixels.stop(LAYER_NAME)
+
+    def state(self) -> dict:
+        """
+        Report the state to restore after a restart.
+
+        :return: A dictionary with the running mode and zone.
+        """
+        return {'mode': self.mode, 'zone': self.zone}
+
+    def restore(self, state: dict):
+        """
+        Restart the mode running before a restart.
+
+        :param state: The state, as reported by state().
+        """
+        if state.get('mode') in MODES and state.get('zone') in self._pixels.zones:
+            self.start(state['mode'], state['zone'])
+
+    def update(self, timestamp: float, position: float, speed: float):
+        """
+        Accept a trajectory sample. Register as an odometer callback.
+
+        :param timestamp: Time of the sample, as seconds since the epoch.
+        :param position: Position, in pulses.
+        :param speed: Smoothed speed, in pulses per second.
+        """
+        self._sample = (timestamp, position, speed)
+        if self.mode is not None:
+            self._pixels.refresh()
+
+    def latency(self) -> dict:
+        """
+        Report pulse-to-photon latency statistics over the recent history.
+
+        :return: A dictionary with the number of samples, the 50th and 99th percentile and maximum latency,
+                 the latency budget, and the number of samples over budget since start.
+        """
+        latencies = np.array(self._latencies)
+        report = {
+            'samples': len(latencies),
+            'budget_ms': self.latency_budget_s * 1000,
+            'over_budget': self._over_budget,
+        }
+        if len(latencies):
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+            report['p50_ms'] = round(float(p50), 3)
+            report['p99_ms'] = round(float(p99), 3)
+            report['max_ms'] = round(float(latencies.max()) * 1000, 3)
+        return report
+
+    def _take_sample(self) -> (float, float):
+        """
+        Read the latest trajectory sample for rendering, and note it for latency measurement.
+
+        :return: A tuple containing the position in pulses and the speed in feet per second.
+        """
+        timestamp, position, speed = self._sample
+        if timestamp is not None and timestamp != self._shown_timestamp:
+            self._rendered_timestamp = timestamp
+        return position, speed / self._pulses_per_foot
+
+    def _frame_shown(self, timestamp: float):
+        """
+        Record the latency of the sample rendered into the frame just written.
+
+        :param timestamp: The time the frame was written.
+        """
+        rendered_timestamp = self._rendered_timestamp
+        if rendered_timestamp is None:
+            return
+        self._rendered_timestamp = None
+        self._shown_timestamp = rendered_timestamp
+        latency_s = timestamp - rendered_timestamp
+        self._latencies.append(latency_s)
+        if latency_s > self.latency_budget_s:
+            self._over_budget += 1
+            log.warning("Pulse-to-photon latency %.1f ms over budget of %.1f ms",
+                        latency_s * 1000, self.latency_budget_s * 1000)
+
+    def _bar_renderer(self, length: int):
+        """
+        Build a renderer for the speedometer bar: green to red with speed, transparent beyond the bar.
+
+        :param length: The number of pixels.
+        :return: Render function for a live layer.
+        """
+        # color ramp along the bar, precomputed
+        ramp = np.linspace(0.0, 1.0, length)
+        colors = np.empty((length, 4), dtype = np.uint8)
+        colors[:, 0] = (np.minimum(1.0, 2.0 * ramp) * 255).astype(np.uint8)
+        colors[:, 1] = (np.minimum(1.0, 2.0 - 2.0 * ramp) * 255).astype(np.uint8)
+        colors[:, 2] = 0
+        indices = np.arange(length)
+        frame = colors.copy()
+
+        def render(now: float) -> np.ndarray:
+            _, speed_ft_s = self._take_sample()
+            fill = min(1.0, speed_ft_s / self._max_speed_ft_s) * length
+            # fully lit up to the bar, fractional alpha on the last pixel
+            frame[:, 3] = (np.clip(fill - indices, 0.0, 1.0) * 255).astype(np.uint8)
+            return frame
+
+        return render
+
+    def _chase_renderer(self, length: int, spacing: int = 8):
+        """
+        Build a renderer for the chase pattern: evenly spaced dots which advance one pixel per encoder pulse,
+        transparent between the dots.
+
+        :param length: The number of pixels.
+        :param spacing: Pixels between dots.
+        :return: Render function for a live layer.
+        """
+        indices = np.arange(length)
+        frame = np.zeros((length, 4), dtype = np.uint8)
+        frame[:, :3] = (255, 255, 255)
+
+        def render(now: float) -> np.ndarray:
+            position, _ = self._take_sample()
+            frame[:, 3] = np.where((indices - int(position)) % spacing == 0, 255, 0)
+            return frame
+
+        return render
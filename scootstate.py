@@ -0,0 +1,220 @@
+import asyncio
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable
+
+# Identifies the current boot of the kernel; shared by containers on the same host
+BOOT_ID_FILE = "/proc/sys/kernel/random/boot_id"
+# Version of the snapshot format; change it when the format of any section changes,
+# so that a snapshot written by an earlier version is ignored
+STATE_VERSION = 1
+
+log = logging.getLogger(__name__)
+
+
+def boot_id() -> str:
+    """
+    Read the identifier of the current boot, which changes whenever the host restarts.
+
+    :return: The boot identifier, or None if unavailable.
+    """
+    try:
+        with open(BOOT_ID_FILE) as boot_id_file:
+            return boot_id_file.read().strip()
+    except OSError:
+        return None
+
+
+class ScootState:
+    """
+    A compact snapshot of the runtime state, so that the service may resume where it left off
+    after a restart rather than booting afresh.
+
+    Each part of the application registers a section, a callable returning a JSON-serializable
+    dictionary. The snapshot is written periodically when it has changed, and once more on exit.
+    Sections which change constantly may be sampled less often, to spare the SD card.
+    A restart is warm if the snapshot was written since the host last booted, such as after a
+    crash, a container update or a SIGINT, by a version writing the same format; the restored
+    sections are then available from get() and restore().
+
+    Attributes:
+        warm (bool): True if a snapshot from before a warm restart was read.
+        saved (float): Time the restored snapshot was written, as seconds since the epoch, or None.
+    """
+
+    def __init__(self, filename: str = "state.json", write_interval_s: float = 1.0,
+                 max_age_s: float = 600.0, timer: bool = True):
+        """
+        Read the snapshot left by the previous run, if any.
+
+        :param filename: Path of the snapshot file.
+        :param write_interval_s: The interval, in seconds, at which changes are written.
+        :param max_age_s: Maximum age of a snapshot for a warm restart, used if the boot
+                          identifier is unavailable.
+        :param timer: Write using a thread. If False, run_async() must be awaited instead.
+        """
+        self.filename = filename
+        self.write_interval_s = write_interval_s
+        self.warm = False
+        self.saved = None
+        # sections by name, as [section, interval_s, time last sampled, last value]
+        self._sections = {}
+        self._restored = {}
+        self._last_written = None
+        self._boot_id = boot_id()
+        self._running = False
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target = lambda: None)
+        self._read(max_age_s)
+        if timer:
+            self._running = True
+            self._thread = threading.Thread(target = self._write_periodically, daemon = True)
+            self._thread.start()
+        atexit.register(self.deinit)
+
+    def _read(self, max_age_s: float):
+        """
+        Read the snapshot file, and keep its sections if the restart is warm.
+        """
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename) as state_file:
+                snapshot = json.load(state_file)
+        except (OSError, ValueError) as e:
+            log.error("Error reading runtime state: %s", e)
+            return
+        if not isinstance(snapshot, dict) or snapshot.get('version') != STATE_VERSION \
+                or not isinstance(snapshot.get('sections'), dict):
+            log.warning("Ignoring runtime state in an unknown format")
+            return
+        saved = snapshot.get('saved', 0.0)
+        if not isinstance(saved, (int, float)):
+            log.warning("Ignoring runtime state in an unknown format")
+            return
+        if self._boot_id is not None:
+            self.warm = snapshot.get('boot_id') == self._boot_id
+        else:
+            self.warm = time.time() - saved < max_age_s
+        if self.warm:
+            self.saved = saved
+            self._restored = snapshot['sections']
+
+    def register(self, name: str, section: Callable[[], dict], interval_s: float = 0.0):
+        """
+        Register a section of the snapshot.
+
+        :param name: The name of the section.
+        :param section: method with signature () -> dict, returning the state to save.
+        :param interval_s: Minimum interval, in seconds, at which the section is sampled. Between samples,
+                           the last sample is written. The final snapshot on exit is always sampled afresh.
+        """
+        self._sections[name] = [section, interval_s, None, None]
+
+    def get(self, name: str) -> dict:
+        """
+        Retrieve a section restored from the previous run.
+
+        :param name: The name of the section.
+        :return: The section, or None on a cold start or if the section was not saved.
+        """
+        return self._restored.get(name)
+
+    def restore(self, name: str, restore: Callable[[dict], None]) -> bool:
+        """
+        Restore a section from the previous run. A malformed section is logged and not restored,
+        so that part of the application starts cold.
+
+        :param name: The name of the section.
+        :param restore: method with signature (section: dict) -> None, restoring the section. Raises
+                        KeyError, TypeError or ValueError if the section is malformed.
+        :return: True if the section was restored, False on a cold start, if the section was not saved,
+                 or if it was malformed.
+        """
+        section = self._restored.get(name)
+        if section is None:
+            return False
+        try:
+            if not isinstance(section, dict):
+                raise TypeError(f"expected an object, not {type(section).__name__}")
+            restore(section)
+            return True
+        except (KeyError, TypeError, ValueError) as e:
+            log.error("Ignoring malformed runtime state section '%s': %r", name, e)
+            return False
+
+    def age_s(self) -> float:
+        """
+        :return: Time since the restored snapshot was written, in seconds, or None on a cold start.
+        """
+        return None if self.saved is None else time.time() - self.saved
+
+    def write(self):
+        """
+        Write the snapshot if it has changed since last written. The file is replaced atomically,
+        so a crash while writing leaves the previous snapshot in place.
+        """
+        with self._lock:
+            if not self._closed:
+                self._write()
+
+    def _sample(self, final: bool) -> dict:
+        """
+        Sample the sections which are due, or all of them for the final snapshot.
+
+        :return: The sections by name.
+        """
+        now = time.monotonic()
+        sections = {}
+        for name, entry in self._sections.items():
+            section, interval_s, sampled, value = entry
+            if final or sampled is None or now - sampled >= interval_s:
+                value = section()
+                entry[2:] = [now, value]
+            sections[name] = value
+        return sections
+
+    def _write(self, final: bool = False):
+        try:
+            sections = self._sample(final)
+            body = json.dumps(sections, sort_keys = True, separators = (",", ":"))
+            if body == self._last_written:
+                return
+            snapshot = {'version': STATE_VERSION, 'saved': time.time(), 'boot_id': self._boot_id,
+                        'sections': sections}
+            temporary = self.filename + ".tmp"
+            with open(temporary, 'w') as state_file:
+                json.dump(snapshot, state_file, separators = (",", ":"))
+            os.replace(temporary, self.filename)
+            self._last_written = body
+        except Exception as e:
+            log.error("Error writing runtime state: %s", e)
+
+    def _write_periodically(self):
+        while self._running:
+            time.sleep(self.write_interval_s)
+            self.write()
+
+    async def run_async(self):
+        """
+        Periodically write the snapshot as a task on the event loop. Runs until cancelled.
+        """
+        while True:
+            await asyncio.sleep(self.write_interval_s)
+            self.write()
+
+    def deinit(self):
+        """
+        Stop writing periodically, and write the snapshot one last time. Nothing is written
+        afterwards, so the snapshot is not overwritten while shutting down.
+        """
+        self._running = False
+        with self._lock:
+            if not self._closed:
+                self._write(final = True)
+                self._closed = True
@@ -0,0 +1,85 @@
+import _thread
+import logging
+from typing import Callable
+
+# gevent replaces threads, locks and events with greenlet equivalents. Loops which must keep their
+# timing while the greenlets are busy, such as the LED pipeline, run in native threads instead
+try:
+    from gevent import monkey
+    _start_native_thread = monkey.get_original('_thread', 'start_new_thread')
+    allocate_lock = monkey.get_original('_thread', 'allocate_lock')
+except ImportError:
+    _start_native_thread = _thread.start_new_thread
+    allocate_lock = _thread.allocate_lock
+
+log = logging.getLogger(__name__)
+
+
+class Signal:
+    """
+    Wakes a native thread. Unlike threading.Event, each wait() consumes the signal, and setting it
+    several times before the wait wakes the waiter once. Setting it never blocks, so greenlets may
+    set it; only native threads should wait on it.
+    """
+
+    def __init__(self):
+        self._lock = allocate_lock()
+        self._lock.acquire()
+
+    def set(self):
+        """
+        Set the signal, waking the waiter.
+        """
+        try:
+            self._lock.release()
+        except RuntimeError:
+            # already set
+            pass
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Wait until the signal is set, and clear it.
+
+        :param timeout: The longest time to wait, in seconds. Defaults to no limit.
+        :return: True if the signal was set, False if the wait timed out.
+        """
+        return self._lock.acquire(timeout = -1 if timeout is None else timeout)
+
+
+class Thread:
+    """
+    A native daemon thread, even under gevent.
+    """
+
+    def __init__(self, target: Callable[[], None], name: str):
+        """
+        Initialize the thread, not started.
+
+        :param target: Called in the thread.
+        :param name: The name of the thread, for reporting errors.
+        """
+        self.name = name
+        self._target = target
+        self._done = allocate_lock()
+
+    def start(self):
+        """
+        Start the thread.
+        """
+        self._done.acquire()
+        _start_native_thread(self._run, ())
+
+    def join(self):
+        """
+        Wait until the thread has returned. Returns immediately if the thread was never started.
+        """
+        with self._done:
+            pass
+
+    def _run(self):
+        try:
+            self._target()
+        except Exception:
+            log.exception("Error in thread %s", self.name)
+        finally:
+            self._done.release()
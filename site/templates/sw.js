@@ -0,0 +1,36 @@
+// Pimp my Gimp service worker
+// Rendered at startup. The cache name changes whenever any precached asset changes.
+const CACHE_NAME = "pimp-my-gimp-{{ version }}";
+const PRECACHE_URLS = {{ precache_urls | tojson }};
+const PRECACHED = new Set(PRECACHE_URLS.map((url) => new URL(url, self.registration.scope).href));
+
+// precache the application shell
+self.addEventListener("install", (event) => {
+    event.waitUntil(
+        caches.open(CACHE_NAME)
+            .then((cache) => cache.addAll(PRECACHE_URLS))
+            .then(() => self.skipWaiting())
+    );
+});
+
+// drop caches from previous versions
+self.addEventListener("activate", (event) => {
+    event.waitUntil(
+        caches.keys()
+            .then((keys) => Promise.all(keys
+                .filter((key) => key.startsWith("pimp-my-gimp-") && key !== CACHE_NAME)
+                .map((key) => caches.delete(key))))
+            .then(() => self.clients.claim())
+    );
+});
+
+// serve the shell from cache; effect commands and the /trajectory websocket go to the network
+self.addEventListener("fetch", (event) => {
+    if (event.request.method !== "GET" || !PRECACHED.has(event.request.url)) {
+        return;
+    }
+    event.respondWith(
+        caches.match(event.request, {cacheName: CACHE_NAME})
+            .then((response) => response || fetch(event.request))
+    );
+});
@@ -0,0 +1,54 @@
+import threading
+
+import numpy as np
+import pytest
+
+import scootchannels
+
+
+class FailingChannel(scootchannels.PixelChannel):
+    def _write(self, frame: np.ndarray):
+        raise RuntimeError("write failed")
+
+
+def test_frame_split_per_channel():
+    segments = [(21, 0, 10), (10, 10, 25)]
+    group = scootchannels.ChannelGroup(scootchannels.simulated_channels(segments))
+    frame = np.arange(25 * 3, dtype = np.uint8).reshape(25, 3)
+    group.write(frame)
+    channels = [channel for channel, _ in group._channels]
+    assert np.array_equal(channels[0].frame, frame[0:10])
+    assert np.array_equal(channels[1].frame, frame[10:25])
+    assert [stats['frames'] for stats in group.stats().values()] == [1, 1]
+    group.deinit()
+
+
+def test_pwm_channels_form_one_output():
+    segments = [(18, 0, 10), (21, 10, 15), (13, 15, 25)]
+    group = scootchannels.ChannelGroup(scootchannels.simulated_channels(segments))
+    frame = np.arange(25 * 3, dtype = np.uint8).reshape(25, 3)
+    group.write(frame)
+    pwm, pcm = [channel for channel, _ in group._channels]
+    assert np.array_equal(pwm.frame, np.concatenate([frame[0:10], frame[15:25]]))
+    assert np.array_equal(pcm.frame, frame[10:15])
+    group.deinit()
+
+
+def test_pins_on_one_channel_rejected():
+    with pytest.raises(ValueError):
+        scootchannels.ws281x_outputs([(12, 0, 10), (18, 10, 20)])
+    with pytest.raises(ValueError):
+        scootchannels.ws281x_outputs([(4, 0, 10), (18, 10, 20)])
+
+
+def test_failing_channel_does_not_hang_group():
+    simulated = scootchannels.SimulatedChannel("sim", 5)
+    group = scootchannels.ChannelGroup([(FailingChannel("failing", 5), slice(0, 5)),
+                                        (simulated, slice(5, 10))])
+    frame = np.full((10, 3), 7, dtype = np.uint8)
+    writer = threading.Thread(target = lambda: [group.write(frame) for _ in range(3)])
+    writer.start()
+    writer.join(timeout = 5)
+    assert not writer.is_alive()
+    assert simulated.stats()['frames'] == 3
+    group.deinit()
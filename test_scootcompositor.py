@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+import scootcompositor
+
+
+def solid(length: int, color: tuple) -> np.ndarray:
+    return np.tile(np.array(color, dtype = np.uint8), (length, 1))
+
+
+def compositor(background: tuple = (0, 0, 0)) -> scootcompositor.Compositor:
+    # not started: frames are composed directly
+    compositor = scootcompositor.Compositor(10, lambda frame, effects: None, {"front": (0, 4)})
+    compositor.background(background)
+    return compositor
+
+
+def hold(frame: np.ndarray, hold_s: float = 10.0):
+    yield frame, hold_s
+
+
+@pytest.mark.parametrize("blend, opacity, expected", [
+    (scootcompositor.BLEND_ALPHA, 0.5, (150, 50, 150)),
+    (scootcompositor.BLEND_ADD, 1.0, (255, 100, 255)),
+    (scootcompositor.BLEND_MAX, 1.0, (200, 100, 200)),
+])
+def test_blend_modes(blend, opacity, expected):
+    below = compositor((100, 100, 100))
+    below.add_layer(scootcompositor.Layer("layer", below.zones["all"], hold(solid(10, (200, 0, 200))),
+                                          blend, opacity))
+    frame, effects = below.compose(0.0)
+    assert np.array_equal(frame, solid(10, expected))
+    assert effects == ("layer",)
+
+
+def test_rgba_layer_blends_per_pixel_alpha():
+    below = compositor((100, 100, 100))
+    layer_frame = np.array([[200, 200, 200, 255], [200, 200, 200, 0]] * 5, dtype = np.uint8)
+    below.add_layer(scootcompositor.Layer("layer", below.zones["all"], hold(layer_frame)))
+    frame, _ = below.compose(0.0)
+    assert np.array_equal(frame[0], (200, 200, 200))
+    assert np.array_equal(frame[1], (100, 100, 100))
+
+
+def test_layer_drawn_in_its_zone_only():
+    below = compositor()
+    below.add_layer(scootcompositor.Layer("front", below.zones["front"], hold(solid(4, (255, 0, 0)))))
+    frame, _ = below.compose(0.0)
+    assert np.array_equal(frame[:4], solid(4, (255, 0, 0)))
+    assert not frame[4:].any()
+
+
+def test_overdue_last_frame_is_shown_once():
+    below = compositor()
+    frames = [(solid(10, (255, 0, 0)), 0.01), (solid(10, (0, 0, 255)), 0.0)]
+    layer = below.add_layer(scootcompositor.Layer("flash", below.zones["all"], iter(frames)))
+    assert below.compose(0.0)[0][0].tolist() == [255, 0, 0]
+    # long after both frames are due, the last is still shown
+    frame, effects = below.compose(1.0)
+    assert frame[0].tolist() == [0, 0, 255]
+    assert effects == ("flash",)
+    # then the layer finishes, and the background is shown again
+    frame, effects = below.compose(1.1)
+    assert layer.finished.is_set()
+    assert not frame.any()
+    assert effects == ("background",)
+    assert below.layers() == []
+
+
+def test_overdue_frames_before_the_last_are_skipped():
+    below = compositor()
+    colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255)]
+    frames = [(solid(10, color), 0.01) for color in colors]
+    below.add_layer(scootcompositor.Layer("sequence", below.zones["all"], iter(frames)))
+    assert below.compose(0.0)[0][0].tolist() == [255, 0, 0]
+    assert below.compose(1.0)[0][0].tolist() == [0, 0, 255]
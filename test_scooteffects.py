@@ -0,0 +1,69 @@
+import json
+import os
+
+import scooteffects
+
+DEFINITION = {
+    "keyframes": [
+        {"time": 0.0, "gradient": ["#000000"]},
+        {"time": 1.0, "gradient": ["#ff0000", "#0000ff"]},
+    ],
+}
+
+
+def library(tmp_path, names = ("first", "second"), reserved = ()):
+    effects_dir = tmp_path / "effects"
+    effects_dir.mkdir()
+    for index, name in enumerate(names):
+        # distinct definitions, so that each compiles to its own program
+        (effects_dir / f"{name}.json").write_text(json.dumps(dict(DEFINITION, duration = 1.0 + index)))
+    effects = scooteffects.EffectLibrary(str(effects_dir), str(tmp_path / "cache") + "/")
+    effects.load(reserved)
+    return effects
+
+
+def test_prepare_from_generator_compiles_every_effect(tmp_path):
+    effects = library(tmp_path)
+    effects.prepare(length for length in (24, 139))
+    assert sorted(effects._programs) == sorted((effect.digest, length)
+                                               for effect in effects for length in (24, 139))
+    assert len(os.listdir(tmp_path / "cache")) == 4
+
+
+def test_truncated_cache_is_compiled_again(tmp_path):
+    effects = library(tmp_path, names = ("first",))
+    effect = next(iter(effects))
+    effects.prepare([24])
+    path = effects._path((effect.digest, 24))
+    with open(path, 'r+b') as cache_file:
+        cache_file.truncate(os.path.getsize(path) // 2)
+
+    # a fresh library, as after a restart, reads the truncated file
+    restarted = scooteffects.EffectLibrary(effects.effects_dir, effects.cache_dir)
+    restarted.load()
+    assert restarted.program(effect, 24).frames.shape[1] == 24
+    # and replaces it with a complete program
+    assert restarted._read((effect.digest, 24)) is not None
+
+
+def test_reserved_names_are_skipped(tmp_path):
+    effects = library(tmp_path, names = ("first", "trajectory"), reserved = ("trajectory",))
+    assert [effect.name for effect in effects] == ["first"]
+
+
+def test_malformed_definitions_are_skipped(tmp_path):
+    effects_dir = tmp_path / "effects"
+    effects_dir.mkdir()
+    malformed = {
+        "list": [DEFINITION],
+        "keyframe-list": {"keyframes": [["#ff0000"]]},
+        "motion-list": dict(DEFINITION, motion = [1.0]),
+        "fps-string": dict(DEFINITION, fps = "fast"),
+        "blend-list": dict(DEFINITION, blend = ["add"]),
+    }
+    for name, definition in malformed.items():
+        (effects_dir / f"{name}.json").write_text(json.dumps(definition))
+    (effects_dir / "valid.json").write_text(json.dumps(DEFINITION))
+    effects = scooteffects.EffectLibrary(str(effects_dir), str(tmp_path / "cache") + "/")
+    effects.load()
+    assert [effect.name for effect in effects] == ["valid"]
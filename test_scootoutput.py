@@ -0,0 +1,84 @@
+import threading
+
+import numpy as np
+
+import scootoutput
+
+
+class Recorder:
+    """
+    Records frames written, and optionally holds the writer in its write until released.
+    """
+
+    def __init__(self, block: bool = False):
+        self.frames = []
+        self.writing = threading.Event()
+        self.release = threading.Event()
+        if not block:
+            self.release.set()
+        self.shown = threading.Semaphore(0)
+
+    def write(self, frame: np.ndarray):
+        self.writing.set()
+        assert self.release.wait(5)
+        self.frames.append(frame)
+
+    def frame_shown(self):
+        self.shown.release()
+
+
+def frame(value: int) -> np.ndarray:
+    return np.full((5, 3), value, dtype = np.uint8)
+
+
+def test_unchanged_frame_is_skipped():
+    recorder = Recorder()
+    stage = scootoutput.OutputStage(recorder.write, recorder.frame_shown)
+    stage.start()
+    for value in (1, 1, 2):
+        stage.submit(frame(value), ("effect",))
+        # shown whether written or skipped
+        assert recorder.shown.acquire(timeout = 5)
+    stage.stop()
+    assert [written[0, 0] for written in recorder.frames] == [1, 2]
+    assert stage.stats() == {'effect': {'written': 2, 'skipped': 1, 'coalesced': 0}}
+
+
+def test_frame_submitted_while_busy_is_coalesced():
+    recorder = Recorder(block = True)
+    stage = scootoutput.OutputStage(recorder.write, recorder.frame_shown)
+    stage.start()
+    stage.submit(frame(1), ("first",))
+    assert recorder.writing.wait(5)
+    # the writer is busy with the first frame: the second is replaced by the third
+    stage.submit(frame(2), ("second",))
+    stage.submit(frame(3), ("third",))
+    recorder.release.set()
+    assert recorder.shown.acquire(timeout = 5)
+    assert recorder.shown.acquire(timeout = 5)
+    stage.stop()
+    assert [written[0, 0] for written in recorder.frames] == [1, 3]
+    assert stage.stats()['second'] == {'written': 0, 'skipped': 0, 'coalesced': 1}
+
+
+def test_counts_kept_per_effect():
+    recorder = Recorder()
+    stage = scootoutput.OutputStage(recorder.write, recorder.frame_shown)
+    stage.start()
+    for value, effects in ((1, ("base", "overlay")), (1, ("base", "overlay")), (2, ("base",))):
+        stage.submit(frame(value), effects)
+        assert recorder.shown.acquire(timeout = 5)
+    stage.stop()
+    assert stage.stats() == {'base': {'written': 2, 'skipped': 1, 'coalesced': 0},
+                             'overlay': {'written': 1, 'skipped': 1, 'coalesced': 0}}
+
+
+def test_tolerance_skips_near_identical_frames():
+    recorder = Recorder()
+    stage = scootoutput.OutputStage(recorder.write, recorder.frame_shown, tolerance = 2)
+    stage.start()
+    for value in (10, 12, 13):
+        stage.submit(frame(value), ("effect",))
+        assert recorder.shown.acquire(timeout = 5)
+    stage.stop()
+    assert [written[0, 0] for written in recorder.frames] == [10, 13]
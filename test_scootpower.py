@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+import scootpower
+
+
+def test_frame_within_budget_is_unchanged():
+    limiter = scootpower.PowerLimiter(10, 1000)
+    frame = np.full((10, 3), 100, dtype = np.uint8)
+    assert np.array_equal(limiter.limit(frame), frame)
+    assert limiter.stats()['limited_frames'] == 0
+
+
+def test_frame_over_budget_is_dimmed_within_budget():
+    limiter = scootpower.PowerLimiter(10, 300)
+    frame = np.full((10, 3), 255, dtype = np.uint8)
+    limited = limiter.limit(frame)
+    assert limiter.estimate(frame) > 300
+    assert limiter.estimate(limited) <= 300
+    # dimmed, not blanked
+    assert limited.max() > 0
+    assert limiter.stats()['limited_frames'] == 1
+
+
+def test_budget_at_or_below_quiescent_current_rejected():
+    with pytest.raises(ValueError):
+        scootpower.PowerLimiter(163, 100)
+    with pytest.raises(ValueError):
+        scootpower.PowerLimiter(100, 100)
@@ -0,0 +1,42 @@
+import json
+
+import scootstate
+
+
+def snapshot_file(tmp_path, **snapshot):
+    path = tmp_path / "state.json"
+    path.write_text(json.dumps(dict({'version': scootstate.STATE_VERSION, 'saved': 0.0,
+                                     'boot_id': scootstate.boot_id()}, **snapshot)))
+    return str(path)
+
+
+def test_snapshot_of_another_version_is_a_cold_start(tmp_path):
+    filename = snapshot_file(tmp_path, version = scootstate.STATE_VERSION + 1, sections = {'pixels': {}})
+    state = scootstate.ScootState(filename, max_age_s = float('inf'), timer = False)
+    assert not state.warm
+    assert state.get('pixels') is None
+    state.deinit()
+
+
+def test_malformed_section_is_not_restored(tmp_path):
+    filename = snapshot_file(tmp_path, sections = {'odometer': {'trip_start': 'far'}, 'pixels': ['red']})
+    state = scootstate.ScootState(filename, max_age_s = float('inf'), timer = False)
+    restored = []
+    assert not state.restore('odometer', lambda section: restored.append(float(section['trip_start'])))
+    assert not state.restore('pixels', restored.append)
+    assert not state.restore('missing', restored.append)
+    assert restored == []
+    state.deinit()
+
+
+def test_sections_survive_a_restart(tmp_path):
+    filename = str(tmp_path / "state.json")
+    state = scootstate.ScootState(filename, timer = False)
+    state.register('pixels', lambda: {'color': [1, 2, 3]})
+    state.deinit()
+    restarted = scootstate.ScootState(filename, max_age_s = float('inf'), timer = False)
+    assert restarted.warm
+    restored = []
+    assert restarted.restore('pixels', restored.append)
+    assert restored == [{'color': [1, 2, 3]}]
+    restarted.deinit()